@@ -0,0 +1,86 @@
+"""
+Бенчмарк сериализации ответа GET /api/movies?limit=100
+Сравнивает CPU на один запрос для разных путей сборки JSON
+
+Запуск: python bench_serialization.py
+"""
+
+import json
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import main
+
+ROWS = 100
+REPEAT = 200
+
+def make_rows() -> List[dict]:
+    """Строки в том виде, в каком их отдает asyncpg (DECIMAL, TIMESTAMP)"""
+    started = datetime(2024, 1, 1, 12, 0, 0)
+    return [
+        {
+            "id": i,
+            "title": f"Movie {i}",
+            "genre": "scifi",
+            "duration": 15 + i % 10,
+            "rating": Decimal("4.5"),
+            "description": "In a world where artificial intelligence controls urban infrastructure. " * 10,
+            "poster_url": f"https://example.com/posters/{i}.jpg",
+            "is_new": i % 2 == 0,
+            "views_count": i * 17,
+            "created_at": started - timedelta(minutes=i),
+            "version": 1,
+            "user_id": 1,
+        }
+        for i in range(ROWS)
+    ]
+
+def response_model_path(rows) -> bytes:
+    """Как было: dict -> валидация List[Movie] -> jsonable_encoder -> json.dumps"""
+    validated = TypeAdapter(List[main.Movie]).validate_python([dict(row) for row in rows])
+    content = jsonable_encoder(validated)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+def fragments_path(rows) -> bytes:
+    """Фрагменты без кэша (каждый раз кодируются заново)"""
+    main.movie_json_cache.clear()
+    return main.render_movies(rows)
+
+def cached_fragments_path(rows) -> bytes:
+    """Фрагменты из прогретого кэша"""
+    return main.render_movies(rows)
+
+def run(name: str, func, rows):
+    seconds = timeit.timeit(lambda: func(rows), number=REPEAT) / REPEAT
+    print(f"{name:<42} {seconds * 1e6:>10.1f} мкс/запрос")
+    return seconds
+
+def main_bench():
+    rows = make_rows()
+    print(f"{ROWS} фильмов, {REPEAT} повторов, orjson: {'да' if main.orjson else 'нет'}\n")
+
+    baseline = run("response_model (валидация + json)", response_model_path, rows)
+
+    main.FAST_JSON = False
+    run("фрагменты: model_validate", fragments_path, rows)
+
+    fast = None
+    if main.orjson is not None:
+        main.FAST_JSON = True
+        fast = run("фрагменты: orjson из строк (FAST_JSON)", fragments_path, rows)
+
+    main.render_movies(rows)
+    cached = run("фрагменты: прогретый кэш", cached_fragments_path, rows)
+
+    print()
+    if fast is not None:
+        print(f"Экономия быстрого пути без кэша: {(baseline - fast) * 1e6:.1f} мкс/запрос")
+    print(f"Экономия с прогретым кэшем:       {(baseline - cached) * 1e6:.1f} мкс/запрос")
+
+if __name__ == "__main__":
+    main_bench()
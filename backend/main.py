@@ -3,18 +3,39 @@ Frame API - Минималистичный и надежный бэкенд дл
 Архитектура "Калашников": простой, надежный, эффективный
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime, timedelta, timezone
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from contextlib import asynccontextmanager, suppress
+from concurrent.futures import ThreadPoolExecutor
 import asyncpg
+import asyncio
+import base64
+import bisect
+import csv
+import heapq
+import io
+import json
 import os
+import re
+import time
+import unicodedata
 from dotenv import load_dotenv
 import jwt
 import bcrypt
 
+try:
+    import orjson  # Необязательная зависимость для быстрого пути FAST_JSON
+except ImportError:
+    orjson = None
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -32,6 +53,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Search-Partial", "ETag"],  # Flutter Web должен видеть эти заголовки
 )
 
 # Настройки из окружения
@@ -40,8 +62,93 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Буферизация счетчика просмотров: сброс в БД раз в N мс или по M событий
+VIEW_FLUSH_INTERVAL_MS = int(os.getenv("VIEW_FLUSH_INTERVAL_MS", "1000"))
+VIEW_FLUSH_MAX_EVENTS = int(os.getenv("VIEW_FLUSH_MAX_EVENTS", "1000"))
+
+# Буфер прогресса просмотра: сброс раз в N мс или по M записей, предел
+# записей в памяти, сверх которого отвечаем 503
+PROGRESS_FLUSH_INTERVAL_MS = int(os.getenv("PROGRESS_FLUSH_INTERVAL_MS", "5000"))
+PROGRESS_FLUSH_MAX_ENTRIES = int(os.getenv("PROGRESS_FLUSH_MAX_ENTRIES", "5000"))
+PROGRESS_MAX_PENDING = int(os.getenv("PROGRESS_MAX_PENDING", "50000"))
+
+# Сверка счетчиков user_stats с исходными таблицами: период и размер пачки
+USER_STATS_REPAIR_INTERVAL = float(os.getenv("USER_STATS_REPAIR_INTERVAL", "3600"))
+USER_STATS_REPAIR_BATCH = int(os.getenv("USER_STATS_REPAIR_BATCH", "500"))
+
+# Пул для bcrypt: потоки и предел очереди, сверх которого отвечаем 503
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", str(BCRYPT_WORKERS * 8)))
+
+# Кэш авторизованных пользователей (get_current_user)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Кэш принадлежности фильмов избранному (флаг is_favorite в списках):
+# пользователей, время жизни и предел известных id на пользователя
+FAVORITES_CACHE_SIZE = int(os.getenv("FAVORITES_CACHE_SIZE", "10000"))
+FAVORITES_CACHE_TTL = float(os.getenv("FAVORITES_CACHE_TTL", "60"))
+FAVORITES_CACHE_MAX_IDS = int(os.getenv("FAVORITES_CACHE_MAX_IDS", "5000"))
+
+# Кэш готового JSON фильмов (фрагменты для сборки списков)
+MOVIE_JSON_CACHE_SIZE = int(os.getenv("MOVIE_JSON_CACHE_SIZE", "50000"))
+MOVIE_JSON_CACHE_TTL = float(os.getenv("MOVIE_JSON_CACHE_TTL", "3600"))
+
+# Быстрый путь сериализации фильмов через orjson: без повторной валидации
+# pydantic, строки приходят из нашей же БД. Без orjson флаг игнорируется
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true" and orjson is not None
+
+# Кэш страниц каталога: свежесть, окно stale-while-revalidate и размер
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "10"))
+CATALOG_CACHE_STALE = float(os.getenv("CATALOG_CACHE_STALE", "60"))
+
+# Выгрузка каталога: строк на одну выборку из серверного курсора
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", "500"))
+
+# Массовая загрузка: строк на один COPY и предел отчета об ошибках
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "1000"))
+
+# Предел id в одном пакетном запросе фильмов
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "100"))
+
+# Фасеты каталога (жанры, гистограмма рейтинга): ключ кэша - версия каталога,
+# TTL лишь ограничивает жизнь записи, если версия долго не меняется
+FACETS_CACHE_TTL = float(os.getenv("FACETS_CACHE_TTL", "300"))
+
+# Главный экран: фильмов в подборке "новое" и в подборке жанра, число жанров
+# и время жизни кэша (ключ - версии каталога и трендов)
+HOME_SECTION_SIZE = int(os.getenv("HOME_SECTION_SIZE", "20"))
+HOME_GENRES_MAX = int(os.getenv("HOME_GENRES_MAX", "10"))
+HOME_CACHE_TTL = float(os.getenv("HOME_CACHE_TTL", "300"))
+
+# Разреженные ответы каталога (?fields=): предел числа разных наборов полей
+# с собственными подготовленными запросами; остальные идут обычным SQL
+MOVIE_FIELDSETS_MAX = int(os.getenv("MOVIE_FIELDSETS_MAX", "32"))
+
+# Сортировка "в тренде": период пересчета очков, период полураспада
+# просмотра и окно почасовой статистики (старше окна просмотры не учитываются)
+TRENDING_REFRESH_INTERVAL = float(os.getenv("TRENDING_REFRESH_INTERVAL", "300"))
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+TRENDING_WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", "168"))
+
+# Нечеткий поиск (pg_trgm), если полнотекстовый нашел меньше limit фильмов:
+# порог похожести и бюджет времени, после которого отдаем то, что нашли
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", "0.3"))
+SEARCH_FUZZY_TIMEOUT_MS = int(os.getenv("SEARCH_FUZZY_TIMEOUT_MS", "50"))
+
+# Подсказки поиска: диапазон ключей, который просматривается на каждый запрос
+# (длиннее - берется хранимый список лучших), и период синхронизации
+TITLE_INDEX_MAX_SCAN = int(os.getenv("TITLE_INDEX_MAX_SCAN", "1000"))
+TITLE_INDEX_SYNC_INTERVAL = float(os.getenv("TITLE_INDEX_SYNC_INTERVAL", "30"))
+# Больше изменений за одну синхронизацию - индекс строится заново (массовая загрузка)
+TITLE_INDEX_REBUILD_CHANGES = int(os.getenv("TITLE_INDEX_REBUILD_CHANGES", "1000"))
+SUGGEST_MAX_K = 50  # Предел k в /api/movies/suggest и размер списков лучших по префиксу
+
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)  # Эндпоинты, открытые и без токена
 
 # ==================== МОДЕЛИ ДАННЫХ ====================
 # Pydantic модели для валидации входящих/исходящих данных
@@ -50,12 +157,20 @@ class MovieBase(BaseModel):
     """Базовая модель фильма"""
     title: str = Field(..., min_length=1, max_length=200)
     genre: str = Field(..., min_length=1, max_length=50)
-    duration: int = Field(..., gt=0, description="Длительность в минутах")
+    duration: int = Field(..., gt=0, le=2**31 - 1, description="Длительность в минутах")
     rating: float = Field(..., ge=0, le=5)
     description: str = Field(..., max_length=1000)
-    poster_url: str
+    poster_url: str = Field(..., max_length=500)  # VARCHAR(500) в БД
     is_new: bool = False
 
+    @field_validator("title", "genre", "description", "poster_url")
+    @classmethod
+    def no_nul(cls, value: str) -> str:
+        """PostgreSQL не хранит символ \\u0000 в тексте: ошибка строки, а не 500"""
+        if "\x00" in value:
+            raise ValueError("NUL characters are not allowed")
+        return value
+
 class MovieCreate(MovieBase):
     """Модель для создания фильма"""
     pass
@@ -66,8 +181,7 @@ class Movie(MovieBase):
     created_at: datetime
     views_count: int = 0
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserBase(BaseModel):
     """Базовая модель пользователя"""
@@ -84,8 +198,13 @@ class User(UserBase):
     created_at: datetime
     is_active: bool = True
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class UserStats(BaseModel):
+    """Статистика пользователя"""
+    watched_count: int = Field(0, description="Фильмов в истории просмотров")
+    favorites_count: int = 0
+    uploaded_count: int = Field(0, description="Загруженных фильмов")
 
 class Token(BaseModel):
     """Модель токена авторизации"""
@@ -97,9 +216,574 @@ class LoginRequest(BaseModel):
     email: str
     password: str
 
+class BulkRowError(BaseModel):
+    """Ошибка одной строки массовой загрузки"""
+    row: int = Field(..., description="Номер записи в теле запроса, с 1")
+    errors: List[str]
+
+class BulkIngestResult(BaseModel):
+    """Итог массовой загрузки"""
+    inserted: int
+    failed: int
+    errors: List[BulkRowError] = Field(..., description="Не больше BULK_MAX_ERRORS записей")
+
+class MovieBatch(BaseModel):
+    """Пакет фильмов в порядке запрошенных id"""
+    movies: List[Movie]
+    missing: List[int]
+
+class MovieSuggestion(BaseModel):
+    """Подсказка поиска"""
+    id: int
+    title: str
+
+class GenreFacet(BaseModel):
+    """Число фильмов жанра"""
+    genre: str
+    count: int
+
+class RatingFacet(BaseModel):
+    """Корзина гистограммы рейтинга"""
+    bucket: int = Field(..., description="Целая часть рейтинга: 4 - от 4.0 до 4.9")
+    count: int
+
+class MovieFacets(BaseModel):
+    """Фасеты каталога для фильтров"""
+    total: int
+    genres: List[GenreFacet]
+    ratings: List[RatingFacet]
+
+class HomeGenreSection(BaseModel):
+    """Подборка жанра на главном экране"""
+    genre: str
+    movies: List[Movie]
+
+class HomeFeed(BaseModel):
+    """Все подборки главного экрана"""
+    featured: Optional[Movie] = Field(None, description="Первый в тренде, иначе лучший по рейтингу")
+    new: List[Movie]
+    genres: List[HomeGenreSection] = Field(..., description="Жанры по числу фильмов, в каждом лучшие по рейтингу")
+
+class ProgressUpdate(BaseModel):
+    """Прогресс просмотра от плеера"""
+    movie_id: int = Field(..., ge=1, le=2**31 - 1)  # INTEGER в БД
+    progress: int = Field(..., ge=0, le=100, description="Прогресс в процентах")
+
+class ContinueWatchingItem(Movie):
+    """Недосмотренный фильм"""
+    progress: int = Field(..., description="Прогресс в процентах")
+    watched_at: datetime
+
+class MovieChanges(BaseModel):
+    """Изменения каталога после версии since"""
+    version: int = Field(..., description="Токен для следующего запроса изменений")
+    after: Optional[int] = Field(None, description="Вместе с version: id, после которого продолжать (при has_more)")
+    updated: List[Movie]
+    deleted: List[int]
+    has_more: bool = Field(False, description="Есть еще изменения: повторить запрос с новым токеном")
+    reset: bool = Field(False, description="Токен устарел: нужна полная синхронизация с since=0")
+
+# ==================== SQL-ЗАПРОСЫ ====================
+# Реестр именованных запросов: каждый объявляется один раз, подготавливается
+# на каждом соединении пула при его создании и вызывается по имени
+
+# Колонки фильма, нужные API: без search_vector и прочих служебных полей
+MOVIE_COLUMNS = (
+    "id, title, genre, duration, rating, description, poster_url, is_new, "
+    "views_count, created_at, version, change_version"
+)
+
+# Порядки каталога и их ключи сортировки (все по убыванию). Под каждый
+# порядок в schema.sql есть индекс, страница - ограниченный index scan
+MOVIE_SORTS: Dict[str, Tuple[str, ...]] = {
+    "new": ("created_at", "id"),
+    "top": ("coalesce(rating, 0)", "views_count", "id"),
+    "trending": ("score", "movie_id"),
+}
+
+# Колонки строки, из которых строится курсор страницы каждого порядка
+MOVIE_SORT_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "new": ("created_at", "id"),
+    "top": ("rating", "views_count", "id"),
+    "trending": ("id",),  # score берется из movie_trending
+}
+
+def movies_page_sql(
+    sort: str,
+    by_genre: bool,
+    after: bool,
+    offset: bool,
+    columns: str = MOVIE_COLUMNS
+) -> str:
+    """
+    Страница каталога
+    Варианты с фильтрами собираются явно, без "$1 IS NULL OR ...": так каждый
+    получает свой план с index scan по (genre, <ключ сортировки>)
+    """
+    keys = MOVIE_SORTS[sort]
+    conditions, n = [], 0
+    if by_genre:
+        n += 1
+        conditions.append(f"genre = ${n}")
+    if after:
+        n += len(keys)
+        params = ", ".join(f"${i}" for i in range(n - len(keys) + 1, n + 1))
+        conditions.append(f"({', '.join(keys)}) < ({params})")
+    n += 1
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    order = ", ".join(f"{key} DESC" for key in keys)
+    if sort == "trending":
+        # Сначала страница из таблицы очков, затем фильмы по первичному ключу
+        return f"""
+            SELECT {columns}, t.score FROM (
+                SELECT movie_id, score FROM movie_trending
+                {where}
+                ORDER BY {order}
+                LIMIT ${n}
+            ) AS t
+            JOIN movies ON movies.id = t.movie_id
+            ORDER BY t.score DESC, t.movie_id DESC
+        """
+    sql = f"""
+        SELECT {columns} FROM movies
+        {where}
+        ORDER BY {order}
+        LIMIT ${n}
+    """
+    if offset:
+        sql += f" OFFSET ${n + 1}"
+    return sql
+
+def movies_page_name(sort: str, by_genre: bool, after: bool, offset: bool) -> str:
+    """Имя варианта запроса страницы каталога"""
+    return (
+        "movies_page" + f"_{sort}" * (sort != "new") +
+        "_genre" * by_genre + "_after" * after + "_offset" * offset
+    )
+
+def movies_page_query(
+    sort: str,
+    by_genre: bool,
+    after: bool,
+    offset: bool,
+    fields: Optional[Tuple[str, ...]] = None
+) -> str:
+    """
+    Запрос страницы каталога: имя из QUERIES или SQL
+    - Без fields - готовый вариант с полным набором колонок
+    - С fields выбираются только эти колонки и ключ курсора. Вариант
+      регистрируется в QUERIES при первом использовании и подготавливается
+      на соединениях лениво
+    - Сверх MOVIE_FIELDSETS_MAX наборов возвращается SQL без регистрации
+    """
+    name = movies_page_name(sort, by_genre, after, offset)
+    if fields is None:
+        return name
+    mask = sum(1 << MOVIE_FIELDS.index(field) for field in fields)
+    name += f"_fields{mask:x}"
+    if name in QUERIES:
+        return name
+    keys = MOVIE_SORT_FIELDS[sort]
+    columns = ", ".join(field for field in MOVIE_FIELDS if field in fields or field in keys)
+    sql = movies_page_sql(sort, by_genre, after, offset, columns)
+    if mask not in _movie_fieldsets and len(_movie_fieldsets) >= MOVIE_FIELDSETS_MAX:
+        return sql
+    _movie_fieldsets.add(mask)
+    QUERIES[name] = sql
+    return name
+
+_movie_fieldsets: set = set()  # Маски наборов полей с зарегистрированными запросами
+
+QUERIES: Dict[str, str] = {
+    # --- Пользователи ---
+    "user_by_id": "SELECT * FROM users WHERE id = $1 AND is_active = true",
+    "user_id_by_email": "SELECT id FROM users WHERE email = $1",
+    "user_for_login": "SELECT id, password_hash FROM users WHERE email = $1 AND is_active = true",
+    "user_insert": """
+        INSERT INTO users (email, username, password_hash, created_at)
+        VALUES ($1, $2, $3, $4)
+        RETURNING id
+    """,
+    "user_deactivate": "UPDATE users SET is_active = false WHERE id = $1",
+    "user_stats": "SELECT watched_count, favorites_count, uploaded_count FROM user_stats WHERE user_id = $1",
+    "user_stats_add_uploaded": """
+        INSERT INTO user_stats AS s (user_id, uploaded_count) VALUES ($1, $2)
+        ON CONFLICT (user_id) DO UPDATE SET uploaded_count = s.uploaded_count + EXCLUDED.uploaded_count
+    """,
+    # Пересчет пачки пользователей с id > $1 коррелированными подзапросами
+    # (каждый - по индексу по user_id). Пишутся только разошедшиеся строки
+    "user_stats_repair": """
+        WITH batch AS (
+            SELECT id FROM users WHERE id > $1 ORDER BY id LIMIT $2
+        ), actual AS (
+            SELECT b.id AS user_id,
+                   (SELECT count(*) FROM watch_history h WHERE h.user_id = b.id) AS watched_count,
+                   (SELECT count(*) FROM favorites f WHERE f.user_id = b.id) AS favorites_count,
+                   (SELECT count(*) FROM movies m WHERE m.user_id = b.id) AS uploaded_count
+            FROM batch b
+        ), fixed AS (
+            INSERT INTO user_stats AS s (user_id, watched_count, favorites_count, uploaded_count)
+            SELECT user_id, watched_count, favorites_count, uploaded_count FROM actual
+            ORDER BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET watched_count = EXCLUDED.watched_count,
+                favorites_count = EXCLUDED.favorites_count,
+                uploaded_count = EXCLUDED.uploaded_count
+            WHERE (s.watched_count, s.favorites_count, s.uploaded_count) IS DISTINCT FROM
+                  (EXCLUDED.watched_count, EXCLUDED.favorites_count, EXCLUDED.uploaded_count)
+            RETURNING s.user_id
+        )
+        SELECT (SELECT max(id) FROM batch) AS last_id, (SELECT count(*) FROM fixed) AS fixed
+    """,
+    "user_stats_repair_lock": "SELECT pg_try_advisory_lock(hashtext('user_stats_repair'))",
+    "user_stats_repair_unlock": "SELECT pg_advisory_unlock(hashtext('user_stats_repair'))",
+
+    # --- Каталог ---
+    "catalog_version": "SELECT version FROM catalog_version",
+    "catalog_trending_version": "SELECT version, trending_version FROM catalog_version",
+    "catalog_state": "SELECT version, reset_version FROM catalog_version",
+    "movie_changes": f"""
+        SELECT {MOVIE_COLUMNS} FROM movies
+        WHERE (change_version, id) > ($1, $2)
+        ORDER BY change_version, id
+        LIMIT $3
+    """,
+    "movie_facets": """
+        SELECT 'genre' AS facet, genre AS value, movie_count FROM genre_counts
+        WHERE movie_count > 0
+        UNION ALL
+        SELECT 'rating', bucket::text, movie_count FROM rating_histogram
+        WHERE movie_count > 0
+    """,
+    # Главный экран одним запросом: герой, новинки и лучшие фильмы жанров.
+    # Жанры берутся из счетчиков фасетов, подборка жанра - LATERAL по
+    # idx_movies_genre_top, поэтому стоимость не растет с размером каталога
+    "home_feed": f"""
+        SELECT 'featured' AS section, NULL::varchar AS section_genre,
+               0::bigint AS genre_count, 1::bigint AS position, {MOVIE_COLUMNS}
+        FROM movies
+        WHERE id = coalesce(
+            (SELECT movie_id FROM movie_trending ORDER BY score DESC, movie_id DESC LIMIT 1),
+            (SELECT id FROM movies ORDER BY coalesce(rating, 0) DESC, views_count DESC, id DESC LIMIT 1)
+        )
+        UNION ALL
+        SELECT 'new', NULL, 0, row_number() OVER (ORDER BY created_at DESC, id DESC), *
+        FROM (
+            SELECT {MOVIE_COLUMNS} FROM movies
+            ORDER BY created_at DESC, id DESC
+            LIMIT $1
+        ) AS latest
+        UNION ALL
+        SELECT 'genre', g.genre, g.movie_count,
+               row_number() OVER (
+                   PARTITION BY g.genre
+                   ORDER BY coalesce(m.rating, 0) DESC, m.views_count DESC, m.id DESC
+               ),
+               m.*
+        FROM (
+            SELECT genre, movie_count FROM genre_counts
+            WHERE movie_count > 0
+            ORDER BY movie_count DESC, genre
+            LIMIT $3
+        ) AS g
+        CROSS JOIN LATERAL (
+            SELECT {MOVIE_COLUMNS} FROM movies
+            WHERE movies.genre = g.genre
+            ORDER BY coalesce(rating, 0) DESC, views_count DESC, id DESC
+            LIMIT $2
+        ) AS m
+        ORDER BY section, genre_count DESC, section_genre, position
+    """,
+    "movies_export": f"SELECT {MOVIE_COLUMNS} FROM movies ORDER BY id",
+    "movie_titles": "SELECT id, title, views_count, rating FROM movies",
+    "local_now": "SELECT LOCALTIMESTAMP",
+    # Счетчики фильмов, просмотренных (любым воркером) с часа $1: сброс
+    # просмотров версию каталога не меняет, поэтому индекс подсказок читает их так
+    "movie_views_since": """
+        SELECT id, views_count FROM movies
+        WHERE id IN (
+            SELECT movie_id FROM movie_views_hourly
+            WHERE hour >= date_trunc('hour', $1::timestamp)
+        )
+    """,
+    "movie_tombstones": """
+        SELECT movie_id, change_version FROM movie_tombstones
+        WHERE (change_version, movie_id) > ($1, $2)
+        ORDER BY change_version, movie_id
+        LIMIT $3
+    """,
+
+    # --- Фильмы ---
+    "movie_by_id": f"SELECT {MOVIE_COLUMNS} FROM movies WHERE id = $1",
+    "movies_by_ids": f"SELECT {MOVIE_COLUMNS} FROM movies WHERE id = ANY($1::int[])",
+    # Фильм и счетчик загрузок автора одним оператором (одна транзакция)
+    "movie_insert": f"""
+        WITH created AS (
+            INSERT INTO movies
+            (title, genre, duration, rating, description, poster_url, is_new, created_at, user_id)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            RETURNING {MOVIE_COLUMNS}, user_id
+        ), counted AS (
+            INSERT INTO user_stats AS s (user_id, uploaded_count)
+            SELECT user_id, 1 FROM created WHERE user_id IS NOT NULL
+            ON CONFLICT (user_id) DO UPDATE SET uploaded_count = s.uploaded_count + 1
+        )
+        SELECT {MOVIE_COLUMNS} FROM created
+    """,
+    "movies_search": f"""
+        SELECT {MOVIE_COLUMNS}, ts_rank(search_vector, query) AS rank
+        FROM movies, to_tsquery('simple', $1) AS query
+        WHERE search_vector @@ query
+        ORDER BY rank DESC, id DESC
+        LIMIT $2
+    """,
+    "movies_search_after": f"""
+        SELECT * FROM (
+            SELECT {MOVIE_COLUMNS}, ts_rank(search_vector, query) AS rank
+            FROM movies, to_tsquery('simple', $1) AS query
+            WHERE search_vector @@ query
+        ) AS hits
+        WHERE (rank, id) < ($2::real, $3)
+        ORDER BY rank DESC, id DESC
+        LIMIT $4
+    """,
+    # Настройки действуют до конца транзакции (is_local = true)
+    "search_fuzzy_settings": """
+        SELECT set_config('pg_trgm.similarity_threshold', $1, true),
+               set_config('statement_timeout', $2, true)
+    """,
+    "movies_fuzzy": f"""
+        SELECT {MOVIE_COLUMNS}, similarity(title, $1) AS score
+        FROM movies
+        WHERE title % $1 AND NOT (id = ANY($3::int[]))
+        ORDER BY score DESC, id DESC
+        LIMIT $2
+    """,
+    # --- Избранное ---
+    # Изменение избранного и счетчик user_stats одним оператором;
+    # счетчик меняется, только если строка действительно добавлена/удалена
+    "favorite_add": """
+        WITH added AS (
+            INSERT INTO favorites (user_id, movie_id) VALUES ($1, $2)
+            ON CONFLICT (user_id, movie_id) DO NOTHING
+            RETURNING user_id
+        )
+        INSERT INTO user_stats AS s (user_id, favorites_count)
+        SELECT user_id, 1 FROM added
+        ON CONFLICT (user_id) DO UPDATE SET favorites_count = s.favorites_count + 1
+    """,
+    "favorite_remove": """
+        WITH removed AS (
+            DELETE FROM favorites WHERE user_id = $1 AND movie_id = $2
+            RETURNING user_id
+        )
+        UPDATE user_stats AS s SET favorites_count = s.favorites_count - 1
+        FROM removed WHERE s.user_id = removed.user_id
+    """,
+    "favorites_among": """
+        SELECT movie_id FROM favorites
+        WHERE user_id = $1 AND movie_id = ANY($2::int[])
+    """,
+    "favorites_page": f"""
+        SELECT f.id AS favorite_id, {", ".join("m." + column for column in MOVIE_COLUMNS.split(", "))}
+        FROM favorites f
+        JOIN movies m ON m.id = f.movie_id
+        WHERE f.user_id = $1
+        ORDER BY f.id DESC
+        LIMIT $2
+    """,
+    "favorites_page_after": f"""
+        SELECT f.id AS favorite_id, {", ".join("m." + column for column in MOVIE_COLUMNS.split(", "))}
+        FROM favorites f
+        JOIN movies m ON m.id = f.movie_id
+        WHERE f.user_id = $1 AND f.id < $2
+        ORDER BY f.id DESC
+        LIMIT $3
+    """,
+
+    # --- История просмотров ---
+    # Несуществующие фильмы и пользователи отсеиваются соединением, а не
+    # ошибкой внешнего ключа на весь пакет. Более старая запись (другой
+    # воркер) не затирает новую. Новые строки истории (xmax = 0: вставка,
+    # а не обновление) тем же оператором прибавляются к user_stats
+    "watch_progress_flush": """
+        WITH written AS (
+            INSERT INTO watch_history AS h (user_id, movie_id, progress, watched_at)
+            SELECT v.user_id, v.movie_id, v.progress, v.watched_at
+            FROM unnest($1::int[], $2::int[], $3::int[], $4::timestamp[])
+                 AS v(user_id, movie_id, progress, watched_at)
+            JOIN movies m ON m.id = v.movie_id
+            JOIN users u ON u.id = v.user_id
+            ORDER BY v.user_id, v.movie_id
+            ON CONFLICT (user_id, movie_id) DO UPDATE
+            SET progress = EXCLUDED.progress, watched_at = EXCLUDED.watched_at
+            WHERE h.watched_at <= EXCLUDED.watched_at
+            RETURNING h.user_id, (h.xmax = 0) AS inserted
+        )
+        INSERT INTO user_stats AS s (user_id, watched_count)
+        SELECT user_id, count(*) FROM written
+        WHERE inserted
+        GROUP BY user_id ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET watched_count = s.watched_count + EXCLUDED.watched_count
+    """,
+
+    # Недосмотренные фильмы: index scan по (user_id, watched_at), прогресс
+    # проверяется по INCLUDE-колонкам индекса, фильмы - по первичному ключу
+    "continue_watching": f"""
+        SELECT h.progress, h.watched_at, {", ".join("m." + column for column in MOVIE_COLUMNS.split(", "))}
+        FROM watch_history h
+        JOIN movies m ON m.id = h.movie_id
+        WHERE h.user_id = $1 AND h.progress > 0 AND h.progress < 100
+        ORDER BY h.watched_at DESC
+        LIMIT $2
+    """,
+
+    # Счетчик и почасовая статистика для "в тренде" одним запросом
+    "movie_views_flush": """
+        WITH counted AS (
+            UPDATE movies AS m
+            SET views_count = m.views_count + v.delta
+            FROM unnest($1::int[], $2::int[]) AS v(id, delta)
+            WHERE m.id = v.id
+            RETURNING m.id, v.delta
+        )
+        INSERT INTO movie_views_hourly AS h (movie_id, hour, views)
+        SELECT id, date_trunc('hour', LOCALTIMESTAMP), delta FROM counted
+        ORDER BY id
+        ON CONFLICT (movie_id, hour) DO UPDATE SET views = h.views + EXCLUDED.views
+    """,
+
+    # --- В тренде ---
+    # Пересчет выполняет один воркер: остальные не получают блокировку и пропускают
+    "trending_lock": "SELECT pg_try_advisory_xact_lock(hashtext('movie_trending'))",
+    # Очки: просмотры за окно $1 часов с экспоненциальным затуханием
+    # (вес просмотра вдвое меньше каждые $2 часов). Фильмы без просмотров
+    # за окно из таблицы удаляются
+    "trending_refresh": """
+        WITH scores AS (
+            SELECT h.movie_id, m.genre,
+                   sum(h.views * exp(
+                       -ln(2) * extract(epoch FROM LOCALTIMESTAMP - h.hour) / 3600 / $2
+                   )) AS score
+            FROM movie_views_hourly h
+            JOIN movies m ON m.id = h.movie_id
+            WHERE h.hour >= LOCALTIMESTAMP - make_interval(hours => $1)
+            GROUP BY h.movie_id, m.genre
+        ), dropped AS (
+            DELETE FROM movie_trending t
+            WHERE NOT EXISTS (SELECT 1 FROM scores s WHERE s.movie_id = t.movie_id)
+        )
+        INSERT INTO movie_trending AS t (movie_id, genre, score)
+        SELECT movie_id, genre, score FROM scores
+        ORDER BY movie_id
+        ON CONFLICT (movie_id) DO UPDATE SET genre = EXCLUDED.genre, score = EXCLUDED.score
+    """,
+    "movie_views_hourly_prune": """
+        DELETE FROM movie_views_hourly
+        WHERE hour < LOCALTIMESTAMP - make_interval(hours => $1)
+    """,
+    "trending_version_bump": "UPDATE catalog_version SET trending_version = trending_version + 1",
+}
+
+# OFFSET (устаревший skip) поддерживается только для сортировки по новизне
+for _sort in MOVIE_SORTS:
+    for _by_genre in (False, True):
+        for _after in (False, True):
+            for _offset in (False, True) if _sort == "new" else (False,):
+                QUERIES[movies_page_name(_sort, _by_genre, _after, _offset)] = \
+                    movies_page_sql(_sort, _by_genre, _after, _offset)
+
+# Массовая загрузка: записи копируются во временную таблицу соединения по мере
+# чтения тела и переносятся в movies одним INSERT ... SELECT в конце. Эти
+# запросы не в реестре: при подготовке соединения временной таблицы еще нет
+BULK_COLUMNS = list(MovieBase.model_fields) + ["created_at", "user_id"]
+BULK_STAGE_CREATE = f"""
+    DROP TABLE IF EXISTS pg_temp.movies_bulk;
+    CREATE TEMP TABLE movies_bulk AS
+        SELECT {", ".join(BULK_COLUMNS)} FROM movies WITH NO DATA
+"""
+BULK_STAGE_APPLY = (
+    f"INSERT INTO movies ({', '.join(BULK_COLUMNS)}) "
+    f"SELECT {', '.join(BULK_COLUMNS)} FROM movies_bulk"
+)
+BULK_STAGE_DROP = "DROP TABLE IF EXISTS pg_temp.movies_bulk"
+
+class QueryStats:
+    """Время выполнения именованных запросов"""
+
+    def __init__(self):
+        self._stats: Dict[str, List[float]] = {}  # name -> [calls, total, max]
+
+    def record(self, name: str, elapsed: float):
+        """Учет одного выполнения"""
+        item = self._stats.setdefault(name, [0, 0.0, 0.0])
+        item[0] += 1
+        item[1] += elapsed
+        item[2] = max(item[2], elapsed)
+
+    def snapshot(self) -> dict:
+        """Сводка в миллисекундах"""
+        return {
+            name: {
+                "calls": calls,
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total / calls * 1000, 3),
+                "max_ms": round(worst * 1000, 3),
+            }
+            for name, (calls, total, worst) in sorted(self._stats.items())
+        }
+
+query_stats = QueryStats()
+
 # ==================== БАЗА ДАННЫХ ====================
 # Пул соединений для эффективной работы с PostgreSQL
 
+class FrameConnection(asyncpg.Connection):
+    """Соединение пула с подготовленными запросами из реестра QUERIES"""
+    __slots__ = ("prepared",)
+
+def is_transient_db_error(exc: BaseException) -> bool:
+    """
+    Ошибка, после которой тот же запрос стоит повторить: связь, блокировки,
+    перегрузка или отмена. Остальные ошибки PostgreSQL (неверные данные,
+    ограничения) повторятся при каждой попытке
+    """
+    if not isinstance(exc, asyncpg.PostgresError):
+        return True
+    return isinstance(exc, (
+        asyncpg.PostgresConnectionError,
+        asyncpg.TransactionRollbackError,
+        asyncpg.OperatorInterventionError,
+        asyncpg.InsufficientResourcesError,
+    ))
+
+async def run_query(conn, method: str, query: str, args: tuple):
+    """
+    Выполнение запроса на соединении
+    - Имя из QUERIES выполняется подготовленным выражением с замером времени
+    - Остальное передается в asyncpg как обычный SQL
+    """
+    if query not in QUERIES:
+        return await getattr(conn, method)(query, *args)
+
+    for attempt in range(2):
+        stmt = conn.prepared.get(query)
+        if stmt is None:
+            stmt = conn.prepared[query] = await conn.prepare(QUERIES[query])
+        started = time.perf_counter()
+        try:
+            if method == "execute":
+                await stmt.fetch(*args)
+                return stmt.get_statusmsg()
+            return await getattr(stmt, method)(*args)
+        except asyncpg.InvalidCachedStatementError:
+            # Схема изменилась: подготавливаем заново (вне транзакции это безопасно)
+            del conn.prepared[query]
+            if attempt or conn.is_in_transaction():
+                raise
+        finally:
+            query_stats.record(query, time.perf_counter() - started)
+
 class Database:
     """Менеджер подключения к БД"""
     pool: Optional[asyncpg.Pool] = None
@@ -112,8 +796,18 @@ class Database:
                 DATABASE_URL,
                 min_size=10,  # Минимум соединений
                 max_size=20,  # Максимум соединений
-                command_timeout=60
+                command_timeout=60,
+                connection_class=FrameConnection,
+                init=cls.prepare_connection
             )
+
+    @staticmethod
+    async def prepare_connection(conn: FrameConnection):
+        """Подготовка всех запросов реестра на новом соединении (прогрев)"""
+        conn.prepared = {}
+        # Копия: реестр пополняется запросами наборов полей во время await
+        for name, sql in list(QUERIES.items()):
+            conn.prepared[name] = await conn.prepare(sql)
     
     @classmethod
     async def disconnect(cls):
@@ -126,30 +820,907 @@ class Database:
     async def execute(cls, query: str, *args):
         """Выполнение запроса без возврата данных"""
         async with cls.pool.acquire() as conn:
-            return await conn.execute(query, *args)
+            return await run_query(conn, "execute", query, args)
     
     @classmethod
     async def fetch(cls, query: str, *args):
         """Выполнение запроса с возвратом множества записей"""
         async with cls.pool.acquire() as conn:
-            return await conn.fetch(query, *args)
+            return await run_query(conn, "fetch", query, args)
     
     @classmethod
     async def fetchrow(cls, query: str, *args):
         """Выполнение запроса с возвратом одной записи"""
         async with cls.pool.acquire() as conn:
-            return await conn.fetchrow(query, *args)
+            return await run_query(conn, "fetchrow", query, args)
+
+    @classmethod
+    async def fetchval(cls, query: str, *args):
+        """Выполнение запроса с возвратом одного значения"""
+        async with cls.pool.acquire() as conn:
+            return await run_query(conn, "fetchval", query, args)
+
+    @classmethod
+    async def copy_records_to_table(cls, table: str, **options):
+        """Загрузка записей через COPY"""
+        async with cls.pool.acquire() as conn:
+            return await conn.copy_records_to_table(table, **options)
+
+class RequestConnection:
+    """
+    Соединение в рамках одного HTTP-запроса
+    - Берется из пула лениво, при первом запросе к БД
+    - Переиспользуется всеми зависимостями и обработчиком
+    - Интерфейс совпадает с Database, поэтому функции принимают любой из них
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self._pool = pool
+        self._conn: Optional[asyncpg.Connection] = None
+
+    async def acquire(self) -> asyncpg.Connection:
+        """Соединение запроса (захватывается один раз)"""
+        if self._conn is None:
+            self._conn = await self._pool.acquire()
+        return self._conn
+
+    async def release(self):
+        """Возврат соединения в пул"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self._pool.release(conn)
+
+    @asynccontextmanager
+    async def transaction(self, **options):
+        """Транзакция на соединении запроса (options - как у asyncpg)"""
+        conn = await self.acquire()
+        async with conn.transaction(**options):
+            yield self
+
+    async def execute(self, query: str, *args):
+        """Выполнение запроса без возврата данных"""
+        return await run_query(await self.acquire(), "execute", query, args)
+
+    async def fetch(self, query: str, *args):
+        """Выполнение запроса с возвратом множества записей"""
+        return await run_query(await self.acquire(), "fetch", query, args)
+
+    async def fetchrow(self, query: str, *args):
+        """Выполнение запроса с возвратом одной записи"""
+        return await run_query(await self.acquire(), "fetchrow", query, args)
+
+    async def fetchval(self, query: str, *args):
+        """Выполнение запроса с возвратом одного значения"""
+        return await run_query(await self.acquire(), "fetchval", query, args)
+
+    async def copy_records_to_table(self, table: str, **options):
+        """Загрузка записей через COPY"""
+        return await (await self.acquire()).copy_records_to_table(table, **options)
+
+async def get_db():
+    """Зависимость FastAPI: одно соединение на запрос"""
+    db = RequestConnection(Database.pool)
+    try:
+        yield db
+    finally:
+        await db.release()
+
+# ==================== КЭШИ ====================
+
+class TTLCache:
+    """
+    LRU-кэш с ограниченным временем жизни записей
+    - Вытесняет самые давно использованные записи сверх maxsize
+    - Считает попадания и промахи
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key) -> Optional[Any]:
+        """Значение по ключу или None, если записи нет или она устарела"""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        """Сохранение значения"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Явное удаление записи"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Удаление всех записей"""
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Размер и счетчики попаданий/промахов"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+class ResponseCache:
+    """
+    Кэш готовых ответов со stale-while-revalidate и single-flight
+    - Запись моложе ttl отдается сразу
+    - Запись моложе ttl + stale_ttl тоже отдается сразу, а в фоне обновляется
+    - Одновременные промахи по одному ключу ждут один общий запрос к БД
+    - invalidate_all() отбрасывает все записи и незавершенные загрузки
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, Any], asyncio.Task] = {}
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[Any]]):
+        """Значение из кэша или результат loader() (один на всех ждущих)"""
+        item = self._data.get(key)
+        if item is not None:
+            age = time.monotonic() - item[0]
+            if age < self.ttl:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return item[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._data.move_to_end(key)
+                self._load(key, loader).add_done_callback(self._log_failure)
+                return item[1]
+        self.misses += 1
+        # shield: отмена одного ожидающего не должна отменять общую загрузку
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key, loader) -> asyncio.Task:
+        flight = (self.generation, key)
+        task = self._inflight.get(flight)
+        if task is None:
+            task = asyncio.create_task(self._fill(flight, loader))
+            self._inflight[flight] = task
+        else:
+            self.coalesced += 1
+        return task
+
+    async def _fill(self, flight, loader):
+        generation, key = flight
+        try:
+            value = await loader()
+            # Результат загрузки, начатой до инвалидации, не сохраняем
+            if generation == self.generation:
+                self._data[key] = (time.monotonic(), value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            return value
+        finally:
+            self._inflight.pop(flight, None)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️ Background cache refresh failed: {task.exception()}")
+
+    def invalidate_all(self):
+        """Сброс всего кэша"""
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Размер и счетчики"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+# Строки users по id: избавляет авторизованные запросы от лишнего SELECT
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Избранное по user_id: {movie_id: в избранном ли}, только уже проверенные
+# фильмы. Свои изменения воркер вносит сразу, чужие видит через TTL
+favorites_cache = TTLCache(FAVORITES_CACHE_SIZE, FAVORITES_CACHE_TTL)
+
+# Готовый JSON фильма по id: значение (version, bytes). Версия строки растет
+# при любом UPDATE (триггер в schema.sql), поэтому запись устаревает сама
+movie_json_cache = TTLCache(MOVIE_JSON_CACHE_SIZE, MOVIE_JSON_CACHE_TTL)
+
+# Готовые страницы каталога по (версии, sort, genre, limit, cursor, fields):
+# (body, next_cursor). Версии в ключе сбрасывают кэш и в других воркерах
+catalog_cache = ResponseCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL, CATALOG_CACHE_STALE)
+
+# Готовый JSON фасетов по версии каталога
+facets_cache = ResponseCache(2, FACETS_CACHE_TTL, 0)
+
+# Готовый JSON главного экрана по (версия каталога, версия трендов)
+home_cache = ResponseCache(2, HOME_CACHE_TTL, 0)
+
+# ==================== СЕРИАЛИЗАЦИЯ ====================
+
+MOVIE_FIELDS = tuple(Movie.model_fields)
+
+def movie_payload(row) -> dict:
+    """Поля модели Movie из строки БД без валидации"""
+    payload = {field: row[field] for field in MOVIE_FIELDS}
+    payload["rating"] = float(payload["rating"])  # DECIMAL -> число JSON
+    return payload
+
+def encode_movie(row) -> bytes:
+    """JSON фильма: быстрый путь или полная валидация моделью Movie"""
+    if FAST_JSON:
+        return orjson.dumps(movie_payload(row))
+    return Movie.model_validate(dict(row)).model_dump_json().encode('utf-8')
+
+def movie_response(payload: dict, response: Optional[Response] = None):
+    """
+    Ответ с одним фильмом: на быстром пути минуя response_model
+    Заголовки, выставленные обработчиком в response, сохраняются
+    """
+    if FAST_JSON:
+        headers = dict(response.headers) if response is not None else None
+        return ORJSONResponse(movie_payload(payload), headers=headers)
+    return payload
+
+def render_movie(row) -> bytes:
+    """JSON фильма, кэшируется по (id, version)"""
+    cached = movie_json_cache.get(row["id"])
+    if cached is not None and cached[0] == row["version"]:
+        return cached[1]
+    fragment = encode_movie(row)
+    movie_json_cache.set(row["id"], (row["version"], fragment))
+    return fragment
+
+def render_movies(rows) -> bytes:
+    """JSON-массив фильмов, склеенный из готовых фрагментов"""
+    return b"[" + b",".join(render_movie(row) for row in rows) + b"]"
+
+def join_movies(fragments, favorites: Optional[List[bool]] = None) -> bytes:
+    """JSON-массив из готовых фрагментов; favorites добавляет в каждый is_favorite"""
+    if favorites is not None:
+        fragments = [
+            fragment[:-1] + (b',"is_favorite":true}' if favorite else b',"is_favorite":false}')
+            for fragment, favorite in zip(fragments, favorites)
+        ]
+    return b"[" + b",".join(fragments) + b"]"
+
+def encode_movie_fields(row, fields: Tuple[str, ...]) -> bytes:
+    """JSON части полей фильма (?fields=), без кэша фрагментов"""
+    payload = {field: row[field] for field in fields}
+    if payload.get("rating") is not None:
+        payload["rating"] = float(payload["rating"])
+    if orjson is not None:
+        return orjson.dumps(payload)
+    if "created_at" in payload:
+        payload["created_at"] = payload["created_at"].isoformat()
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+def encode_movies_csv(rows, header: bool = False) -> bytes:
+    """Строки фильмов в CSV (колонки модели Movie)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(MOVIE_FIELDS)
+    for row in rows:
+        payload = movie_payload(row)
+        payload["created_at"] = payload["created_at"].isoformat()
+        writer.writerow(payload.values())
+    return buffer.getvalue().encode('utf-8')
+
+async def iter_body_lines(request: Request) -> AsyncIterator[bytes]:
+    """Строки тела запроса по мере поступления, без чтения тела целиком"""
+    tail = b""
+    async for chunk in request.stream():
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+async def iter_bulk_records(
+    request: Request,
+    bulk_format: str
+) -> AsyncIterator[Tuple[int, Union[dict, str]]]:
+    """
+    Записи массовой загрузки: (номер, поля) или (номер, текст ошибки разбора)
+    CSV: первая строка - заголовок, пустые значения считаются отсутствующими
+    """
+    number = 0
+    if bulk_format == "ndjson":
+        async for line in iter_body_lines(request):
+            if number == 0:
+                line = line.removeprefix(b"\xef\xbb\xbf")  # BOM
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                item = json.loads(line)
+            except ValueError as exc:
+                yield number, f"Invalid JSON: {exc}"
+                continue
+            if isinstance(item, dict):
+                yield number, item
+            else:
+                yield number, "Invalid JSON: expected an object"
+        return
+
+    header, pending = None, []
+    async for line in iter_body_lines(request):
+        pending.append(line.decode('utf-8', errors='replace').rstrip("\r"))
+        # Нечетное число кавычек: значение в кавычках продолжается на следующей строке
+        if sum(part.count('"') for part in pending) % 2:
+            continue
+        record, pending = "\n".join(pending), []
+        if header is None:
+            # Excel сохраняет UTF-8 с BOM: иначе первая колонка - "\ufefftitle"
+            record = record.lstrip("\ufeff")
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = values
+            continue
+        number += 1
+        yield number, {key: value for key, value in zip(header, values) if value != ""}
+    if pending:
+        yield number + 1, "Invalid CSV: unterminated quoted value"
+
+def encode_export_batch(rows, export_format: str) -> bytes:
+    """Пачка строк выгрузки в NDJSON или CSV"""
+    if export_format == "csv":
+        return encode_movies_csv(rows)
+    return b"".join(encode_movie(row) + b"\n" for row in rows)
+
+async def stream_movies_export(export_format: str):
+    """
+    Потоковая выгрузка каталога через серверный курсор
+    - В памяти не больше EXPORT_PREFETCH строк, каталог любого размера
+    - Один снимок данных (REPEATABLE READ) на всю выгрузку
+    - Фрагменты не кэшируются, чтобы выгрузка не вытеснила горячие фильмы
+    """
+    async with Database.pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            if export_format == "csv":
+                yield encode_movies_csv([], header=True)
+            batch = []
+            cursor = conn.prepared["movies_export"].cursor(prefetch=EXPORT_PREFETCH)
+            async for row in cursor:
+                batch.append(row)
+                if len(batch) >= EXPORT_PREFETCH:
+                    yield encode_export_batch(batch, export_format)
+                    batch.clear()
+            if batch:
+                yield encode_export_batch(batch, export_format)
+
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+
+class WriteBehindBuffer(ABC):
+    """
+    Основа буферов с отложенной записью в БД
+    - flush() вызывается раз в interval_ms или раньше, по wake()
+    - При остановке выполняется финальный flush(); его сбой только
+      записывается в лог, чтобы остановка остальных буферов продолжилась
+    """
+
+    name = "Buffer"
+
+    def __init__(self, interval_ms: int):
+        self.interval = interval_ms / 1000
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        """Досрочный сброс"""
+        self._wakeup.set()
+
+    @abstractmethod
+    async def flush(self):
+        """Запись накопленного в БД"""
+
+    async def _run(self):
+        while True:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as exc:
+                print(f"⚠️ {self.name} flush failed: {exc}")
+
+    def start(self):
+        """Запуск периодического сброса"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка с финальным сбросом буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as exc:
+            print(f"⚠️ {self.name} final flush failed: {exc}")
+
+class ViewCounter(WriteBehindBuffer):
+    """
+    Буферизованный счетчик просмотров (write-behind)
+    - Инкременты копятся в памяти по movie_id
+    - Сбрасываются одним UPDATE раз в interval_ms или по max_events событий
+    - Путь чтения фильма не делает ни одной записи в БД
+    """
+
+    name = "View counter"
+
+    def __init__(self, interval_ms: int, max_events: int):
+        super().__init__(interval_ms)
+        self.max_events = max_events
+        self.pending: Dict[int, int] = {}
+        self.events = 0
+        self.on_flush: List[Callable[[Dict[int, int]], None]] = []  # Подписчики на записанные инкременты
+
+    def add(self, movie_id: int):
+        """Учет одного просмотра"""
+        self.pending[movie_id] = self.pending.get(movie_id, 0) + 1
+        self.events += 1
+        if self.events >= self.max_events:
+            self.wake()
+
+    def pending_for(self, movie_id: int) -> int:
+        """Просмотры, еще не записанные в БД"""
+        return self.pending.get(movie_id, 0)
+
+    async def flush(self):
+        """Запись накопленных инкрементов одним запросом"""
+        if not self.pending:
+            return
+        batch, self.pending, self.events = self.pending, {}, 0
+        # Сортировка задает одинаковый порядок блокировки строк во всех воркерах
+        ids = sorted(batch)
+        try:
+            await Database.execute(
+                "movie_views_flush",
+                ids, [batch[movie_id] for movie_id in ids]
+            )
+        except BaseException as exc:
+            # Временный сбой: возвращаем инкременты в буфер, чтобы не потерять их.
+            # Постоянный отбрасываем: иначе он повторялся бы при каждом сбросе
+            if is_transient_db_error(exc):
+                for movie_id, delta in batch.items():
+                    self.pending[movie_id] = self.pending.get(movie_id, 0) + delta
+            else:
+                print(f"⚠️ View counter dropped {len(batch)} movies")
+            raise
+        for listener in self.on_flush:
+            listener(batch)
+
+view_counter = ViewCounter(VIEW_FLUSH_INTERVAL_MS, VIEW_FLUSH_MAX_EVENTS)
+
+class ProgressBuffer(WriteBehindBuffer):
+    """
+    Буфер прогресса просмотра
+    - Хранит только последний прогресс по (user_id, movie_id): частые
+      отметки плеера схлопываются в одну запись
+    - Сбрасывается одним UPSERT из массивов раз в interval_ms или по max_entries
+    - Память ограничена: сверх max_pending новые пары получают 503
+    """
+
+    name = "Watch progress"
+
+    def __init__(self, interval_ms: int, max_entries: int, max_pending: int):
+        super().__init__(interval_ms)
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        # user_id -> movie_id -> (progress, watched_at): записи пользователя
+        # доступны без перебора всего буфера
+        self.pending: Dict[int, Dict[int, Tuple[int, datetime]]] = {}
+        self.size = 0
+        self.reports = 0
+        self.rejected = 0
+
+    def add(self, user_id: int, movie_id: int, progress: int):
+        """Новый прогресс заменяет несохраненный предыдущий"""
+        movies = self.pending.get(user_id)
+        is_new = movies is None or movie_id not in movies
+        if is_new and self.size >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Watch progress is temporarily overloaded, try again later",
+                headers={"Retry-After": "1"}
+            )
+        self.pending.setdefault(user_id, {})[movie_id] = (progress, datetime.utcnow())
+        self.size += is_new
+        self.reports += 1
+        if self.size >= self.max_entries:
+            self.wake()
+
+    def pending_for(self, user_id: int) -> Dict[int, Tuple[int, datetime]]:
+        """Еще не записанный прогресс пользователя: movie_id -> (progress, watched_at)"""
+        return dict(self.pending.get(user_id, {}))
+
+    async def flush(self):
+        """Запись последних значений одним запросом"""
+        if not self.pending:
+            return
+        batch, self.pending, self.size = self.pending, {}, 0
+        keys = sorted((user_id, movie_id) for user_id, movies in batch.items() for movie_id in movies)
+        try:
+            await Database.execute(
+                "watch_progress_flush",
+                [user_id for user_id, _ in keys],
+                [movie_id for _, movie_id in keys],
+                [batch[user_id][movie_id][0] for user_id, movie_id in keys],
+                [batch[user_id][movie_id][1] for user_id, movie_id in keys]
+            )
+        except BaseException as exc:
+            # Постоянная ошибка повторялась бы при каждом сбросе: пакет отбрасываем
+            if not is_transient_db_error(exc):
+                print(f"⚠️ Watch progress dropped {len(keys)} entries")
+                raise
+            # Возвращаем в буфер то, что не успело смениться более новым значением
+            for user_id, movies in batch.items():
+                pending = self.pending.setdefault(user_id, {})
+                for movie_id, value in movies.items():
+                    if movie_id not in pending:
+                        pending[movie_id] = value
+                        self.size += 1
+            raise
+
+    def stats(self) -> dict:
+        """Размер буфера и счетчики"""
+        return {
+            "pending": self.size,
+            "max_pending": self.max_pending,
+            "reports": self.reports,
+            "rejected": self.rejected,
+        }
+
+progress_buffer = ProgressBuffer(PROGRESS_FLUSH_INTERVAL_MS, PROGRESS_FLUSH_MAX_ENTRIES, PROGRESS_MAX_PENDING)
+
+class PeriodicTask:
+    """Фоновая корутина, выполняемая раз в interval секунд"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.func()
+            except Exception as exc:
+                print(f"⚠️ {self.name} failed: {exc}")
+
+    def start(self):
+        """Запуск"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка"""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+def fold_text(text: str) -> str:
+    """Свертка текста для поиска: без регистра и диакритики, одиночные пробелы"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.split())
+
+class TitleIndex:
+    """
+    Префиксный индекс названий в памяти для подсказок поиска
+    - Ключи - свернутое название с начала каждого слова ("neural city", "city")
+    - Поиск префикса - bisect по отсортированному списку (ключ, id)
+    - Строится одним проходом при запуске (в потоке), дальше обновляется
+      точечно и догоняет изменения других воркеров по ленте изменений каталога
+    - Синхронизация применяет изменения пачкой с одной сортировкой, а после
+      крупных изменений (больше rebuild_changes) строит индекс заново
+    - Подсказки ранжируются по просмотрам, затем по рейтингу, среди всех
+      названий с префиксом. Диапазон до max_scan ключей просматривается целиком,
+      для длинных (короткие префиксы вроде "a") хранится список top_size лучших
+    - Просмотры других воркеров подтягиваются при синхронизации
+    """
+
+    SORT_CHUNK = 50000  # Размер части при сортировке ключей в потоке
+
+    def __init__(self, max_scan: int, rebuild_changes: int, top_size: int):
+        self.max_scan = max_scan
+        self.rebuild_changes = rebuild_changes
+        self.top_size = top_size
+        self.version = 0  # Версия каталога, до которой индекс актуален
+        self.views_at: Optional[datetime] = None  # Время БД последнего чтения просмотров
+        self._entries: List[Tuple[str, int]] = []
+        self._movies: Dict[int, list] = {}  # id -> [title, views_count, rating]
+        self._top: Dict[str, List[int]] = {}  # Префикс длинного диапазона -> лучшие id
+        self._top_len = 0  # Длина самого длинного префикса в _top
+
+    @staticmethod
+    def _keys(title: str) -> List[str]:
+        folded = fold_text(title)
+        return [folded[match.start():] for match in re.finditer(r"\S+", folded)]
+
+    def _rank(self, movie_id: int) -> tuple:
+        movie = self._movies[movie_id]
+        return movie[1], movie[2], -movie_id
+
+    @classmethod
+    def _build(cls, rows) -> Tuple[Dict[int, list], List[Tuple[str, int]]]:
+        """Фильмы и отсортированные ключи (выполняется в потоке)"""
+        movies = {
+            row["id"]: [row["title"], row["views_count"] or 0, float(row["rating"] or 0)]
+            for row in rows
+        }
+        entries = [
+            (key, movie_id)
+            for movie_id, (title, _, _) in movies.items()
+            for key in cls._keys(title)
+        ]
+        # list.sort не отпускает GIL до конца: сортируем частями, а слияние
+        # heapq.merge - обычный Python-код, и цикл событий не простаивает
+        chunks = [
+            sorted(entries[i:i + cls.SORT_CHUNK])
+            for i in range(0, len(entries), cls.SORT_CHUNK)
+        ]
+        return movies, list(heapq.merge(*chunks))
+
+    async def load(self):
+        """Полное построение индекса одним проходом по movies"""
+        state = await Database.fetchrow("catalog_state")
+        views_at = await Database.fetchval("local_now")
+        rows = await Database.fetch("movie_titles")
+        movies, entries = await asyncio.to_thread(self._build, rows)
+        self._entries, self._movies, self.version = entries, movies, state["version"]
+        self._top, self._top_len = {}, 0
+        self.views_at = views_at
+
+    async def sync(self):
+        """Применение изменений каталога после self.version и свежих просмотров"""
+        await self.refresh_views()
+        state = await Database.fetchrow("catalog_state")
+        if state["version"] == self.version:
+            return
+        if self.version < state["reset_version"]:
+            await self.load()
+            return
+        # Заполненная лента - изменений не меньше порога: полный проход дешевле
+        # точечных правок и не держит цикл событий на каждой вставке
+        updated = await Database.fetch("movie_changes", self.version, None, self.rebuild_changes)
+        deleted = await Database.fetch("movie_tombstones", self.version, None, self.rebuild_changes)
+        if len(updated) >= self.rebuild_changes or len(deleted) >= self.rebuild_changes:
+            await self.load()
+            return
+        self.apply(updated, [row["movie_id"] for row in deleted])
+        self.version = state["version"]
+
+    async def refresh_views(self):
+        """Счетчики просмотров, записанные всеми воркерами после прошлого чтения"""
+        if self.views_at is None:
+            return
+        views_at = await Database.fetchval("local_now")
+        rows = await Database.fetch("movie_views_since", self.views_at)
+        for row in rows:
+            self.set_views(row["id"], row["views_count"])
+        self.views_at = views_at
+
+    def apply(self, rows, deleted_ids: List[int]):
+        """Пакет изменений: один проход по ключам и одна сортировка"""
+        stale = {row["id"] for row in rows} | set(deleted_ids)
+        if any(movie_id in self._movies for movie_id in stale):
+            self._entries = [entry for entry in self._entries if entry[1] not in stale]
+        for movie_id in stale:
+            self._movies.pop(movie_id, None)
+        for row in rows:
+            self._movies[row["id"]] = [row["title"], row["views_count"] or 0, float(row["rating"] or 0)]
+            self._entries.extend((key, row["id"]) for key in self._keys(row["title"]))
+        # Timsort: отсортированный список с коротким хвостом сортируется за линейное время
+        self._entries.sort()
+        # Списки лучших пересчитаются при следующем запросе префикса
+        self._top, self._top_len = {}, 0
+
+    def add(self, movie_id: int, title: str, views_count: int, rating):
+        """Добавление или обновление фильма"""
+        self.remove(movie_id)
+        self._movies[movie_id] = [title, views_count or 0, float(rating or 0)]
+        for key in self._keys(title):
+            bisect.insort(self._entries, (key, movie_id))
+        self._forget(movie_id)
+
+    def remove(self, movie_id: int):
+        """Удаление фильма"""
+        if movie_id not in self._movies:
+            return
+        self._forget(movie_id)
+        movie = self._movies.pop(movie_id)
+        for key in self._keys(movie[0]):
+            i = bisect.bisect_left(self._entries, (key, movie_id))
+            if i < len(self._entries) and self._entries[i] == (key, movie_id):
+                del self._entries[i]
+
+    def __contains__(self, movie_id: int) -> bool:
+        return movie_id in self._movies
+
+    def add_views(self, deltas: Dict[int, int]):
+        """Учет записанных просмотров (подписчик ViewCounter.on_flush)"""
+        for movie_id, delta in deltas.items():
+            movie = self._movies.get(movie_id)
+            if movie is not None:
+                self.set_views(movie_id, movie[1] + delta)
+
+    def set_views(self, movie_id: int, views_count: int):
+        """Новый счетчик просмотров с поправкой списков лучших"""
+        movie = self._movies.get(movie_id)
+        if movie is None or movie[1] == views_count:
+            return
+        grew, movie[1] = views_count > movie[1], views_count
+        if not grew:
+            self._forget(movie_id)
+            return
+        # Очки только растут: фильм может лишь войти в список или подняться в нем
+        rank = self._rank(movie_id)
+        for prefix in self._cached_prefixes(movie_id):
+            top = self._top[prefix]
+            if movie_id not in top:
+                if len(top) >= self.top_size and rank <= self._rank(top[-1]):
+                    continue
+                top.append(movie_id)
+            top.sort(key=self._rank, reverse=True)
+            del top[self.top_size:]
+
+    def _cached_prefixes(self, movie_id: int) -> set:
+        """Префиксы из _top, под которые подходит название фильма"""
+        if not self._top:
+            return set()
+        return {
+            key[:end]
+            for key in self._keys(self._movies[movie_id][0])
+            for end in range(1, min(len(key), self._top_len) + 1)
+            if key[:end] in self._top
+        }
+
+    def _forget(self, movie_id: int):
+        """Сброс списков лучших, на которые влияет фильм"""
+        for prefix in self._cached_prefixes(movie_id):
+            del self._top[prefix]
+
+    def suggest(self, q: str, k: int) -> List[dict]:
+        """До k самых популярных названий, начинающихся с q (с любого слова)"""
+        prefix = fold_text(q)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._entries, (prefix,))
+        end = bisect.bisect_left(self._entries, (prefix + "\U0010ffff",), start)
+        if end - start <= self.max_scan:
+            candidates = {movie_id for _, movie_id in self._entries[start:end]}
+            best = heapq.nlargest(k, candidates, key=self._rank)
+        else:
+            # Длинный диапазон: полный проход один раз, дальше список лучших
+            # поддерживается при просмотрах и сбрасывается при изменениях
+            top = self._top.get(prefix)
+            if top is None:
+                candidates = {movie_id for _, movie_id in self._entries[start:end]}
+                top = self._top[prefix] = heapq.nlargest(self.top_size, candidates, key=self._rank)
+                self._top_len = max(self._top_len, len(prefix))
+            best = top[:k]
+        return [{"id": movie_id, "title": self._movies[movie_id][0]} for movie_id in best]
+
+    def stats(self) -> dict:
+        """Размер индекса"""
+        return {
+            "movies": len(self._movies), "keys": len(self._entries),
+            "top_prefixes": len(self._top), "version": self.version,
+        }
+
+title_index = TitleIndex(TITLE_INDEX_MAX_SCAN, TITLE_INDEX_REBUILD_CHANGES, SUGGEST_MAX_K)
+view_counter.on_flush.append(title_index.add_views)
+title_index_sync = PeriodicTask("Title index sync", TITLE_INDEX_SYNC_INTERVAL, title_index.sync)
+
+async def refresh_trending():
+    """
+    Пересчет очков "в тренде" из почасовой статистики просмотров
+    - Одна транзакция: очки, очистка старой статистики и новая версия
+      трендов (сбрасывает ETag и кэш страниц sort=trending)
+    - Из нескольких воркеров пересчет выполняет тот, кто взял блокировку
+    """
+    db = RequestConnection(Database.pool)
+    try:
+        async with db.transaction():
+            if not await db.fetchval("trending_lock"):
+                return
+            await db.execute("trending_refresh", TRENDING_WINDOW_HOURS, TRENDING_HALF_LIFE_HOURS)
+            await db.execute("movie_views_hourly_prune", TRENDING_WINDOW_HOURS)
+            await db.execute("trending_version_bump")
+    finally:
+        await db.release()
+
+trending_refresh = PeriodicTask("Trending refresh", TRENDING_REFRESH_INTERVAL, refresh_trending)
+
+async def repair_user_stats():
+    """
+    Сверка user_stats с исходными таблицами пачками по USER_STATS_REPAIR_BATCH
+    - Исправляет расхождения после ручных правок БД и удалений фильмов
+    - Каждая пачка - отдельная короткая транзакция
+    - Из нескольких воркеров проход выполняет тот, кто взял блокировку
+    """
+    db = RequestConnection(Database.pool)
+    try:
+        if not await db.fetchval("user_stats_repair_lock"):
+            return
+        try:
+            last_id, fixed = 0, 0
+            while True:
+                result = await db.fetchrow("user_stats_repair", last_id, USER_STATS_REPAIR_BATCH)
+                if result["last_id"] is None:
+                    break
+                last_id = result["last_id"]
+                fixed += result["fixed"]
+            if fixed:
+                print(f"🔧 User stats repaired: {fixed}")
+        finally:
+            await db.fetchval("user_stats_repair_unlock")
+    finally:
+        await db.release()
+
+user_stats_repair = PeriodicTask("User stats repair", USER_STATS_REPAIR_INTERVAL, repair_user_stats)
 
 # События жизненного цикла приложения
 @app.on_event("startup")
 async def startup():
     """Инициализация при запуске"""
     await Database.connect()
+    view_counter.start()
+    progress_buffer.start()
+    password_hasher.start()
+    await title_index.load()
+    title_index_sync.start()
+    trending_refresh.start()
+    user_stats_repair.start()
     print("✅ Database connected")
 
 @app.on_event("shutdown")
 async def shutdown():
     """Очистка при остановке"""
+    await title_index_sync.stop()
+    await trending_refresh.stop()
+    await user_stats_repair.stop()
+    await view_counter.stop()
+    await progress_buffer.stop()
+    password_hasher.stop()
     await Database.disconnect()
     print("❌ Database disconnected")
 
@@ -167,6 +1738,72 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         hashed_password.encode('utf-8')
     )
 
+class PasswordHasher:
+    """
+    Выполнение bcrypt в отдельном ограниченном пуле потоков
+    - bcrypt отпускает GIL, поэтому event loop не блокируется
+    - При переполнении очереди запрос сразу получает 503
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0  # Выполняются + ждут в очереди
+        self.completed = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Создание пула потоков"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="bcrypt"
+            )
+
+    def stop(self):
+        """Остановка пула потоков"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is temporarily overloaded, try again later",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        """Асинхронный hash_password"""
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Асинхронный verify_password"""
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        """Метрики очереди"""
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "queued": max(0, self.pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+password_hasher = PasswordHasher(BCRYPT_WORKERS, BCRYPT_MAX_PENDING)
+
 def create_access_token(data: dict) -> str:
     """Создание JWT токена"""
     to_encode = data.copy()
@@ -174,35 +1811,174 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def encode_cursor(*key) -> str:
+    """Непрозрачный курсор страницы: ключ сортировки последней записи"""
+    raw = "|".join(
+        part.isoformat() if isinstance(part, datetime) else str(part)
+        for part in key
+    )
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str, *parsers: Callable[[str], Any]) -> tuple:
+    """Разбор курсора от клиента: parsers разбирают части ключа по порядку"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        parts = raw.decode('utf-8').split("|")
+        if len(parts) != len(parsers):
+            raise ValueError("cursor key length mismatch")
+        return tuple(parse(part) for parse, part in zip(parsers, parts))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def encode_page_cursor(sort: str, row) -> str:
+    """Курсор страницы каталога; кроме "new", начинается с имени сортировки"""
+    if sort == "top":
+        return encode_cursor(sort, row["rating"] or 0, row["views_count"], row["id"])
+    if sort == "trending":
+        return encode_cursor(sort, row["score"], row["id"])
+    return encode_cursor(row["created_at"], row["id"])
+
+def decode_page_cursor(sort: str, cursor: str) -> tuple:
+    """Ключ из курсора страницы; курсор другой сортировки дает 400"""
+    def tag(part: str) -> str:
+        if part != sort:
+            raise ValueError("cursor sort mismatch")
+        return part
+
+    def rating(part: str) -> Decimal:
+        # Decimal, а не float: сравнение с DECIMAL в БД должно быть точным
+        try:
+            return Decimal(part)
+        except ArithmeticError:
+            raise ValueError("invalid rating")
+
+    if sort == "top":
+        return decode_cursor(cursor, tag, rating, int, int)[1:]
+    if sort == "trending":
+        return decode_cursor(cursor, tag, float, int)[1:]
+    return decode_cursor(cursor, datetime.fromisoformat, int)
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Параметр fields -> поля модели Movie в порядке модели
+    None, если нужны все поля; неизвестное поле дает 400
+    """
+    if fields is None:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested.difference(MOVIE_FIELDS)
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}" if unknown else "Empty fields"
+        )
+    if len(requested) == len(MOVIE_FIELDS):
+        return None
+    return tuple(field for field in MOVIE_FIELDS if field in requested)
+
+def to_search_query(q: str) -> Optional[str]:
+    """
+    Текст поиска -> tsquery: все слова обязательны, последнее - как префикс
+    (поиск по мере набора). Берутся только буквы и цифры, поэтому синтаксис
+    tsquery из пользовательского ввода не проходит
+    """
+    words = re.findall(r"\w+", q.lower())
+    if not words:
+        return None
+    # Префикс из одной буквы совпал бы с большей частью каталога
+    if len(words[-1]) >= 2:
+        words[-1] += ":*"
+    return " & ".join(words)
+
+def catalog_etag(*versions: int) -> str:
+    """
+    ETag по глобальной версии каталога (и версии трендов для sort=trending)
+    Слабый: счетчик просмотров меняется без смены версии
+    """
+    return f'W/"{".".join(map(str, versions))}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка If-None-Match (слабое сравнение, RFC 9110)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def not_modified(etag: str) -> Response:
+    """Ответ 304 без тела"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: RequestConnection = Depends(get_db)
+):
     """Получение текущего пользователя из токена"""
     token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials"
-            )
-    except jwt.PyJWTError:
+        user_id = int(payload["sub"])  # RFC 7519: sub - строка
+    except (jwt.PyJWTError, KeyError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials"
         )
     
-    # Получаем пользователя из БД
-    user = await Database.fetchrow(
-        "SELECT * FROM users WHERE id = $1 AND is_active = true",
-        user_id
-    )
+    # Сначала кэш, затем БД
+    user = user_cache.get(user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
+        row = await db.fetchrow("user_by_id", user_id)
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        user = dict(row)
+        user_cache.set(user_id, user)
     return dict(user)
 
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: RequestConnection = Depends(get_db)
+) -> Optional[dict]:
+    """Текущий пользователь, если токен передан (неверный токен - 401)"""
+    if credentials is None:
+        return None
+    return await get_current_user(credentials, db)
+
+async def favorite_flags(db, user_id: int, movie_ids: List[int]) -> List[bool]:
+    """
+    В избранном ли фильмы, по порядку movie_ids
+    Неизвестные кэшу id проверяются одним запросом movie_id = ANY($2)
+    """
+    known = favorites_cache.get(user_id)
+    if known is None or len(known) > FAVORITES_CACHE_MAX_IDS:
+        known = {}
+        favorites_cache.set(user_id, known)
+    unknown = [movie_id for movie_id in movie_ids if movie_id not in known]
+    if unknown:
+        rows = await db.fetch("favorites_among", user_id, unknown)
+        found = {row["movie_id"] for row in rows}
+        for movie_id in unknown:
+            known[movie_id] = movie_id in found
+    return [known[movie_id] for movie_id in movie_ids]
+
+def remember_favorite(user_id: int, movie_id: int, favorite: bool):
+    """Изменение избранного в кэше (если пользователь в нем есть)"""
+    known = favorites_cache.get(user_id)
+    if known is not None:
+        known[movie_id] = favorite
+
+async def deactivate_user(db, user_id: int):
+    """Деактивация пользователя с явным сбросом записи в кэше"""
+    await db.execute("user_deactivate", user_id)
+    user_cache.invalidate(user_id)
+
 # ==================== API ENDPOINTS ====================
 
 @app.get("/", tags=["General"])
@@ -214,10 +1990,27 @@ async def root():
         "docs": "/docs"
     }
 
+@app.get("/api/metrics", tags=["General"])
+async def metrics():
+    """Внутренние метрики процесса (очереди, буферы)"""
+    return {
+        "password_hasher": password_hasher.stats(),
+        "view_counter": {"pending_movies": len(view_counter.pending)},
+        "progress_buffer": progress_buffer.stats(),
+        "user_cache": user_cache.stats(),
+        "favorites_cache": favorites_cache.stats(),
+        "movie_json_cache": movie_json_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "facets_cache": facets_cache.stats(),
+        "home_cache": home_cache.stats(),
+        "title_index": title_index.stats(),
+        "queries": query_stats.snapshot(),
+    }
+
 # --- Аутентификация ---
 
 @app.post("/api/auth/register", response_model=Token, tags=["Auth"])
-async def register(user: UserCreate):
+async def register(user: UserCreate, db: RequestConnection = Depends(get_db)):
     """
     Регистрация нового пользователя
     - Проверяет уникальность email
@@ -225,10 +2018,10 @@ async def register(user: UserCreate):
     - Создает JWT токен
     """
     # Проверяем, существует ли пользователь
-    existing = await Database.fetchrow(
-        "SELECT id FROM users WHERE email = $1",
-        user.email
-    )
+    existing = await db.fetchrow("user_id_by_email", user.email)
+    # bcrypt идет без соединения: иначе поток входов занимает весь пул
+    # и чтение каталога ждет pool.acquire()
+    await db.release()
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -236,73 +2029,633 @@ async def register(user: UserCreate):
         )
     
     # Создаем пользователя
-    hashed_password = hash_password(user.password)
-    new_user = await Database.fetchrow(
-        """
-        INSERT INTO users (email, username, password_hash, created_at)
-        VALUES ($1, $2, $3, $4)
-        RETURNING id
-        """,
+    hashed_password = await password_hasher.hash(user.password)
+    new_user = await db.fetchrow(
+        "user_insert",
         user.email, user.username, hashed_password, datetime.utcnow()
     )
+    # get_db освобождает соединение только после отправки тела ответа
+    await db.release()
     
     # Создаем токен
-    access_token = create_access_token(data={"sub": new_user["id"]})
+    access_token = create_access_token(data={"sub": str(new_user["id"])})
     return Token(access_token=access_token)
 
 @app.post("/api/auth/login", response_model=Token, tags=["Auth"])
-async def login(request: LoginRequest):
+async def login(request: LoginRequest, db: RequestConnection = Depends(get_db)):
     """
     Авторизация пользователя
     - Проверяет email и пароль
     - Возвращает JWT токен
     """
     # Находим пользователя
-    user = await Database.fetchrow(
-        "SELECT id, password_hash FROM users WHERE email = $1 AND is_active = true",
-        request.email
-    )
+    user = await db.fetchrow("user_for_login", request.email)
+    # bcrypt идет без соединения (см. register)
+    await db.release()
     
-    if not user or not verify_password(request.password, user["password_hash"]):
+    if not user or not await password_hasher.verify(request.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
     # Создаем токен
-    access_token = create_access_token(data={"sub": user["id"]})
+    access_token = create_access_token(data={"sub": str(user["id"])})
     return Token(access_token=access_token)
 
+# --- Пользователи ---
+
+@app.delete("/api/users/me", status_code=status.HTTP_204_NO_CONTENT, tags=["Users"])
+async def deactivate_me(
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """Деактивация собственного аккаунта"""
+    await deactivate_user(db, current_user["id"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.get("/api/users/me/stats", response_model=UserStats, tags=["Users"])
+async def get_my_stats(
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Статистика текущего пользователя
+    - Готовые счетчики из user_stats (одна строка по первичному ключу),
+      без подсчета по истории, избранному и фильмам
+    - Прогресс из буфера учитывается после его сброса в БД
+    """
+    row = await db.fetchrow("user_stats", current_user["id"])
+    return UserStats(**dict(row)) if row is not None else UserStats()
+
+# --- Избранное ---
+
+@app.get("/api/favorites", response_model=List[Movie], tags=["Favorites"])
+async def get_favorites(
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Избранное текущего пользователя, сначала недавно добавленные
+    - Курсорная пагинация, курсор следующей страницы в заголовке X-Next-Cursor
+    """
+    user_id = current_user["id"]
+    if cursor is None:
+        rows = await db.fetch("favorites_page", user_id, limit + 1)
+    else:
+        (favorite_id,) = decode_cursor(cursor, int)
+        rows = await db.fetch("favorites_page_after", user_id, favorite_id, limit + 1)
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1]["favorite_id"])
+    for row in rows:
+        remember_favorite(user_id, row["id"], True)
+    return Response(content=render_movies(rows), media_type="application/json", headers=headers)
+
+@app.post("/api/favorites/{movie_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Favorites"])
+async def add_favorite(
+    movie_id: int = Path(..., ge=1, le=2**31 - 1),  # INTEGER в БД
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """Добавление в избранное (повторное добавление ничего не меняет)"""
+    try:
+        await db.execute("favorite_add", current_user["id"], movie_id)
+    except asyncpg.ForeignKeyViolationError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Movie not found"
+        )
+    remember_favorite(current_user["id"], movie_id, True)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.delete("/api/favorites/{movie_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Favorites"])
+async def remove_favorite(
+    movie_id: int = Path(..., ge=1, le=2**31 - 1),  # INTEGER в БД
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """Удаление из избранного (отсутствующий фильм - тоже 204)"""
+    await db.execute("favorite_remove", current_user["id"], movie_id)
+    remember_favorite(current_user["id"], movie_id, False)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+# --- История просмотров ---
+
+@app.post("/api/history/progress", status_code=status.HTTP_202_ACCEPTED, tags=["History"])
+async def report_progress(
+    update: ProgressUpdate,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Прогресс просмотра от плеера (можно отправлять каждые несколько секунд)
+    - Пишется в буфер и попадает в БД пакетом, запрос не ждет записи
+    - Неизвестный фильм при сбросе молча отбрасывается
+    """
+    progress_buffer.add(current_user["id"], update.movie_id, update.progress)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+@app.get("/api/history/continue", response_model=List[ContinueWatchingItem], tags=["History"])
+async def continue_watching(
+    limit: int = Query(20, ge=1, le=50),
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    "Продолжить просмотр": начатые и не досмотренные фильмы (0 < progress < 100)
+    - Сначала недавние
+    - Прогресс из буфера, еще не записанный в БД, учитывается сразу
+    """
+    pending = progress_buffer.pending_for(current_user["id"])
+    # Запас на записи, которые буфер исключит (досмотрены до 100)
+    rows = await db.fetch("continue_watching", current_user["id"], limit + len(pending))
+    items = {row["id"]: (row["progress"], row["watched_at"], row) for row in rows}
+    unknown = [movie_id for movie_id in pending if movie_id not in items]
+    if unknown:
+        for row in await db.fetch("movies_by_ids", unknown):
+            items[row["id"]] = (0, None, row)
+    for movie_id, (progress, watched_at) in pending.items():
+        if movie_id in items:
+            items[movie_id] = (progress, watched_at, items[movie_id][2])
+
+    started = sorted(
+        (item for item in items.values() if 0 < item[0] < 100),
+        key=lambda item: item[1],
+        reverse=True
+    )[:limit]
+    body = b"[" + b",".join(
+        render_movie(row)[:-1] + b',"progress":' + str(progress).encode() +
+        b',"watched_at":"' + watched_at.isoformat().encode() + b'"}'
+        for progress, watched_at, row in started
+    ) + b"]"
+    return Response(content=body, media_type="application/json")
+
 # --- Фильмы ---
 
+async def load_movies_page(
+    sort: str,
+    genre: Optional[str],
+    limit: int,
+    after: Optional[tuple],
+    skip: Optional[int] = None,
+    fields: Optional[Tuple[str, ...]] = None
+) -> Tuple[List[int], List[bytes], Optional[str]]:
+    """
+    Страница каталога: id, JSON фильмов и курсор следующей страницы
+    fields - часть полей фильма (колонки выбираются из БД только эти)
+    Выполняется через пул, а не соединение запроса: загрузку может
+    разделять несколько запросов или фоновое обновление кэша
+    """
+    args = []
+    if genre is not None:
+        args.append(genre)
+    if after is not None:
+        args.extend(after)
+    # Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница
+    args.append(limit + 1)
+    if skip is not None:
+        args.append(skip)
+
+    query = movies_page_query(sort, genre is not None, after is not None, skip is not None, fields)
+    rows = await Database.fetch(query, *args)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(sort, rows[-1])
+    ids = [row["id"] for row in rows]
+    if fields is not None:
+        return ids, [encode_movie_fields(row, fields) for row in rows], next_cursor
+    # Ответ собирается из кэшированных фрагментов, минуя повторную сериализацию
+    return ids, [render_movie(row) for row in rows], next_cursor
+
 @app.get("/api/movies", response_model=List[Movie], tags=["Movies"])
 async def get_movies(
-    skip: int = 0,
-    limit: int = 100,
-    genre: Optional[str] = None
+    limit: int = Query(100, ge=1, le=100),
+    genre: Optional[str] = None,
+    sort: str = Query("new", pattern="^(new|top|trending)$"),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Поля через запятую, например id,title,poster_url,rating"),
+    skip: Optional[int] = Query(None, ge=0, deprecated=True),
+    if_none_match: Optional[str] = Header(None),
+    user: Optional[dict] = Depends(get_optional_user),
+    db: RequestConnection = Depends(get_db)
 ):
     """
     Получение списка фильмов
-    - Поддерживает пагинацию
+    - sort: new - сначала новые, top - по рейтингу и просмотрам,
+      trending - по затухающим очкам недавних просмотров (пересчет в фоне,
+      в выдаче только фильмы с просмотрами за TRENDING_WINDOW_HOURS)
+    - Курсорная (keyset) пагинация: курсор следующей страницы в заголовке X-Next-Cursor
     - Фильтрация по жанру
+    - fields: только перечисленные поля (меньше колонок из БД и байт в ответе)
+    - Страницы кэшируются в памяти и сбрасываются при создании фильма
+    - ETag по версии каталога: при совпадении 304 без запроса списка.
+      У sort=top ETag нет: порядок зависит от просмотров, а их сброс версию
+      не меняет (страница из кэша устаревает не дольше CATALOG_CACHE_TTL)
+    - С токеном у фильмов есть is_favorite (один запрос на страницу);
+      такой ответ личный и отдается без ETag
+    - skip оставлен для старых клиентов (OFFSET, медленно на глубоких страницах, без кэша)
+    """
+    if skip is not None and cursor is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either cursor or skip, not both"
+        )
+    if skip is not None and sort != "new":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="skip is only supported with sort=new"
+        )
+
+    after = decode_page_cursor(sort, cursor) if cursor is not None else None
+    fieldset = parse_fields(fields)
+    # Версия читается через соединение запроса (его уже мог взять
+    # get_optional_user), и оно возвращается в пул до загрузки страницы через
+    # пул: держать одно соединение, ожидая другое, - взаимная блокировка
+    # пула под нагрузкой
+    if sort == "trending":
+        state = await db.fetchrow("catalog_trending_version")
+        versions = (state["version"], state["trending_version"])
+    else:
+        versions = (await db.fetchval("catalog_version"),)
+    await db.release()
+    etag = catalog_etag(*versions)
+    # Избранное в версию каталога не входит: личный ответ без ETag
+    validatable = user is None and sort != "top"
+    if validatable and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    if validatable:
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Authorization"}
+    elif user is None:
+        headers = {"Cache-Control": "no-cache", "Vary": "Authorization"}
+    else:
+        headers = {"Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if skip is not None:
+        ids, fragments, next_cursor = await load_movies_page(sort, genre, limit, after, skip, fieldset)
+        headers["Deprecation"] = "true"
+    else:
+        ids, fragments, next_cursor = await catalog_cache.get_or_load(
+            (versions, sort, genre, limit, cursor, fieldset),
+            lambda: load_movies_page(sort, genre, limit, after, fields=fieldset)
+        )
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    favorites = await favorite_flags(db, user["id"], ids) if user is not None else None
+    return Response(content=join_movies(fragments, favorites), media_type="application/json", headers=headers)
+
+async def load_movie_facets() -> bytes:
+    """JSON фасетов из счетчиков, которые триггеры ведут в genre_counts и rating_histogram"""
+    rows = await Database.fetch("movie_facets")
+    genres = sorted(
+        (GenreFacet(genre=row["value"], count=row["movie_count"])
+         for row in rows if row["facet"] == "genre"),
+        key=lambda facet: (-facet.count, facet.genre)
+    )
+    ratings = sorted(
+        (RatingFacet(bucket=int(row["value"]), count=row["movie_count"])
+         for row in rows if row["facet"] == "rating"),
+        key=lambda facet: facet.bucket
+    )
+    facets = MovieFacets(
+        total=sum(facet.count for facet in genres),
+        genres=genres,
+        ratings=ratings
+    )
+    return facets.model_dump_json().encode('utf-8')
+
+@app.get("/api/movies/facets", response_model=MovieFacets, tags=["Movies"])
+async def get_movie_facets(if_none_match: Optional[str] = Header(None)):
     """
-    query = """
-        SELECT * FROM movies 
-        WHERE ($1::text IS NULL OR genre = $1)
-        ORDER BY created_at DESC
-        LIMIT $2 OFFSET $3
+    Число фильмов по жанрам и гистограмма рейтинга для фильтров
+    - Счетчики ведутся триггерами при записи, чтение не делает GROUP BY по movies
+    - Ответ кэшируется в памяти по версии каталога, ETag как у списка фильмов
     """
-    
-    rows = await Database.fetch(query, genre, limit, skip)
-    return [dict(row) for row in rows]
+    version = await Database.fetchval("catalog_version")
+    etag = catalog_etag(version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    body = await facets_cache.get_or_load(version, load_movie_facets)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
 
-@app.get("/api/movies/{movie_id}", response_model=Movie, tags=["Movies"])
-async def get_movie(movie_id: int):
-    """Получение информации о конкретном фильме"""
-    movie = await Database.fetchrow(
-        "SELECT * FROM movies WHERE id = $1",
-        movie_id
+async def load_home_feed() -> bytes:
+    """JSON главного экрана из одного запроса, фильмы - из кэша фрагментов"""
+    rows = await Database.fetch("home_feed", HOME_SECTION_SIZE, HOME_SECTION_SIZE, HOME_GENRES_MAX)
+    featured = [row for row in rows if row["section"] == "featured"]
+    latest = [row for row in rows if row["section"] == "new"]
+    genres: Dict[str, list] = {}
+    for row in rows:
+        if row["section"] == "genre":
+            genres.setdefault(row["section_genre"], []).append(row)
+    return b"".join((
+        b'{"featured":', render_movie(featured[0]) if featured else b"null",
+        b',"new":', render_movies(latest),
+        b',"genres":[', b",".join(
+            b'{"genre":' + json.dumps(genre, ensure_ascii=False).encode('utf-8') +
+            b',"movies":' + render_movies(movies) + b"}"
+            for genre, movies in genres.items()
+        ),
+        b"]}",
+    ))
+
+@app.get("/api/home", response_model=HomeFeed, tags=["Movies"])
+async def get_home(if_none_match: Optional[str] = Header(None)):
+    """
+    Главный экран одним запросом
+    - Герой, новинки и лучшие фильмы самых больших жанров
+    - Собирается одним SQL-запросом и кэшируется целиком по версиям
+      каталога и трендов, ETag/304 как у списка фильмов
+    """
+    state = await Database.fetchrow("catalog_trending_version")
+    versions = (state["version"], state["trending_version"])
+    etag = catalog_etag(*versions)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    body = await home_cache.get_or_load(versions, load_home_feed)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
+
+def merge_changes(updated, deleted, limit: int) -> Tuple[list, bool]:
+    """
+    Слияние ленты изменений и надгробий по (версия, id)
+    - Возвращает не больше limit изменений (version, id, строка или None для
+      удаленного) и признак, что после последнего из них есть еще изменения
+    - Каждая лента прочитана не дальше limit записей: если одна заполнена
+      или слияние обрезано, продолжать нужно с (version, id) последнего изменения
+    - Версию выдает оператор, а не строка: у одной версии бывает много строк,
+      но только одного вида (изменение или удаление)
+    """
+    changes = sorted(
+        [(row["change_version"], row["id"], row) for row in updated] +
+        [(row["change_version"], row["movie_id"], None) for row in deleted],
+        key=lambda change: change[:2]
+    )
+    has_more = len(updated) == limit or len(deleted) == limit or len(changes) > limit
+    return changes[:limit], has_more
+
+@app.get("/api/movies/changes", response_model=MovieChanges, tags=["Movies"])
+async def get_movie_changes(
+    since: int = Query(0, ge=0, description="Токен из предыдущего ответа, 0 - полная синхронизация"),
+    after: Optional[int] = Query(None, ge=0, le=2**31 - 1, description="after из предыдущего ответа, если он есть"),
+    limit: int = Query(500, ge=1, le=1000),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Лента изменений каталога для дельта-синхронизации
+    - Возвращает добавленные/измененные фильмы и id удаленных после версии since
+    - Объем ответа зависит от числа изменений, а не от размера каталога
+    - При has_more продолжать с since=version и after из ответа
+    - Счетчик просмотров версию не меняет и в ленту не попадает
+    """
+    # Снимок в одной транзакции: версия и строки согласованы между собой
+    async with db.transaction(isolation="repeatable_read", readonly=True):
+        state = await db.fetchrow("catalog_state")
+        if 0 < since < state["reset_version"]:
+            # Каталог очищался (TRUNCATE) после since: надгробий за этот период нет
+            return MovieChanges(version=state["version"], updated=[], deleted=[], reset=True)
+        # after=None: версия since получена целиком ((v, NULL) > (since, NULL) - только v > since)
+        updated = await db.fetch("movie_changes", since, after, limit)
+        deleted = await db.fetch("movie_tombstones", since, after, limit)
+
+    changes, has_more = merge_changes(updated, deleted, limit)
+    if has_more and changes:
+        version, after = changes[-1][:2]
+    else:
+        version, after = state["version"], None
+
+    updated_rows = [row for _, _, row in changes if row is not None]
+    deleted_ids = [movie_id for _, movie_id, row in changes if row is None]
+    body = b"".join((
+        b'{"version":', str(version).encode(),
+        b',"after":', b"null" if after is None else str(after).encode(),
+        b',"updated":', render_movies(updated_rows),
+        b',"deleted":[', ",".join(map(str, deleted_ids)).encode(),
+        b'],"has_more":', b"true" if has_more else b"false",
+        b',"reset":false}',
+    ))
+    return Response(content=body, media_type="application/json")
+
+@app.get("/api/movies/export", tags=["Movies"])
+async def export_movies(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")
+):
+    """
+    Выгрузка всего каталога потоком
+    - format=ndjson: один фильм JSON на строку
+    - format=csv: CSV с заголовком
+    """
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_movies_export(export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="movies.{export_format}"'}
     )
+
+@app.post("/api/movies/bulk", response_model=BulkIngestResult, tags=["Movies"])
+async def bulk_create_movies(
+    request: Request,
+    bulk_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Массовая загрузка фильмов (требует авторизации)
+    - Тело читается потоком: NDJSON (объект на строку) или CSV с заголовком
+    - Каждая запись проверяется моделью MovieBase, ошибки возвращаются построчно
+    - Корректные записи копируются (COPY) пачками по BULK_CHUNK_SIZE во
+      временную таблицу, пока читается тело: ожидание клиента не держит
+      транзакцию и блокировку версии каталога
+    - В каталог все записи попадают одним оператором в короткой транзакции
+      (одна версия каталога на загрузку)
+    """
+    created_at = datetime.utcnow()
+    inserted, failed, errors, chunk = 0, 0, [], []
+
+    def report(number: int, messages: List[str]):
+        nonlocal failed
+        failed += 1
+        if len(errors) < BULK_MAX_ERRORS:
+            errors.append(BulkRowError(row=number, errors=messages))
+
+    await db.execute(BULK_STAGE_CREATE)
+    try:
+        async for number, item in iter_bulk_records(request, bulk_format):
+            if isinstance(item, str):
+                report(number, [item])
+                continue
+            try:
+                movie = MovieBase.model_validate(item)
+            except ValidationError as exc:
+                report(number, [
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                    for error in exc.errors()
+                ])
+                continue
+            chunk.append((
+                movie.title, movie.genre, movie.duration, Decimal(str(movie.rating)),
+                movie.description, movie.poster_url, movie.is_new,
+                created_at, current_user['id']
+            ))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await db.copy_records_to_table("movies_bulk", records=chunk, columns=BULK_COLUMNS)
+                inserted += len(chunk)
+                chunk = []
+        if chunk:
+            await db.copy_records_to_table("movies_bulk", records=chunk, columns=BULK_COLUMNS)
+            inserted += len(chunk)
+        async with db.transaction():
+            if inserted:
+                await db.execute(BULK_STAGE_APPLY)
+                await db.execute("user_stats_add_uploaded", current_user['id'], inserted)
+            await db.execute(BULK_STAGE_DROP)
+    except BaseException:
+        # Оборванная загрузка: в каталог ничего не попало, черновик удаляется
+        # (если соединение уже непригодно - вместе с сеансом или следующей загрузкой)
+        with suppress(Exception):
+            await db.execute(BULK_STAGE_DROP)
+        raise
+
+    # Индекс догоняет каталог через пул: соединение запроса больше не нужно
+    await db.release()
+    if inserted:
+        catalog_cache.invalidate_all()
+        await title_index.sync()
+    return BulkIngestResult(inserted=inserted, failed=failed, errors=errors)
+
+@app.get("/api/movies/batch", response_model=MovieBatch, tags=["Movies"])
+async def get_movies_batch(
+    ids: str = Query(..., description="id фильмов через запятую"),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Пакетное получение фильмов (избранное, история)
+    - Один запрос WHERE id = ANY($1) вместо запроса на каждый фильм
+    - Порядок совпадает с запрошенным, отсутствующие id перечислены в missing
+    - Просмотры не засчитываются
+    """
+    try:
+        # dict.fromkeys убирает повторы, сохраняя порядок
+        movie_ids = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids must be a comma-separated list of integers"
+        )
+    if not 0 < len(movie_ids) <= BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Pass from 1 to {BATCH_MAX_IDS} ids"
+        )
+    # id в БД - INTEGER: больший параметр asyncpg не передаст (DataError, 500)
+    if not all(1 <= movie_id <= 2**31 - 1 for movie_id in movie_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"ids must be between 1 and {2**31 - 1}"
+        )
+
+    rows = {row["id"]: row for row in await db.fetch("movies_by_ids", movie_ids)}
+    found = [rows[movie_id] for movie_id in movie_ids if movie_id in rows]
+    missing = [movie_id for movie_id in movie_ids if movie_id not in rows]
+    body = b"".join((
+        b'{"movies":', render_movies(found),
+        b',"missing":[', ",".join(map(str, missing)).encode(), b']}',
+    ))
+    return Response(content=body, media_type="application/json")
+
+@app.get("/api/movies/search", response_model=List[Movie], tags=["Movies"])
+async def search_movies(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user: Optional[dict] = Depends(get_optional_user),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Полнотекстовый поиск по названию и описанию
+    - GIN-индекс по search_vector, сортировка по ts_rank (название весомее описания)
+    - Последнее слово ищется как префикс: подходит для поиска по мере набора
+    - Курсорная пагинация по (rank, id), курсор в заголовке X-Next-Cursor
+    - Если на первой странице меньше limit совпадений, она дополняется
+      похожими по триграммам названиями (опечатки: "Nural City").
+      Не уложились в SEARCH_FUZZY_TIMEOUT_MS - ответ с X-Search-Partial: true
+    - С токеном у фильмов есть is_favorite
+    """
+    query = to_search_query(q)
+    if query is None:
+        return Response(content=b"[]", media_type="application/json")
+
+    if cursor is None:
+        rows = await db.fetch("movies_search", query, limit + 1)
+    else:
+        rank, movie_id = decode_cursor(cursor, float, int)
+        rows = await db.fetch("movies_search_after", query, rank, movie_id, limit + 1)
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1]["rank"], rows[-1]["id"])
+    elif cursor is None and len(rows) < limit:
+        try:
+            async with db.transaction():
+                await db.fetchrow(
+                    "search_fuzzy_settings",
+                    str(SEARCH_FUZZY_THRESHOLD), f"{SEARCH_FUZZY_TIMEOUT_MS}ms"
+                )
+                rows += await db.fetch(
+                    "movies_fuzzy", q, limit - len(rows), [row["id"] for row in rows]
+                )
+        except asyncpg.QueryCanceledError:
+            headers["X-Search-Partial"] = "true"
+    if user is None:
+        return Response(content=render_movies(rows), media_type="application/json", headers=headers)
+    favorites = await favorite_flags(db, user["id"], [row["id"] for row in rows])
+    body = join_movies([render_movie(row) for row in rows], favorites)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/movies/suggest", response_model=List[MovieSuggestion], tags=["Movies"])
+async def suggest_movies(
+    q: str = Query(..., min_length=1, max_length=200),
+    k: int = Query(10, ge=1, le=SUGGEST_MAX_K)
+):
+    """
+    Подсказки для строки поиска из индекса в памяти, без запроса к БД
+    - Без учета регистра и диакритики, по началу любого слова названия
+    - Сначала популярные (просмотры, затем рейтинг)
+    """
+    return title_index.suggest(q, k)
+
+@app.get("/api/movies/{movie_id}", response_model=Movie, tags=["Movies"])
+async def get_movie(
+    response: Response,
+    movie_id: int = Path(..., ge=1, le=2**31 - 1),  # INTEGER в БД
+    if_none_match: Optional[str] = Header(None),
+    db: RequestConnection = Depends(get_db)
+):
+    """
+    Получение информации о конкретном фильме
+    - ETag по версии каталога: при совпадении 304 без чтения фильма
+    """
+    etag = catalog_etag(await db.fetchval("catalog_version"))
+    # 304 - только фильму, который есть (If-None-Match: * подходит к любому id).
+    # Фильма нет в индексе этого воркера (удален или еще не синхронизирован) -
+    # чтение из БД ниже ответит 404 или полным ответом
+    if movie_id in title_index and etag_matches(if_none_match, etag):
+        # Клиент открыл фильм повторно: просмотр засчитываем и без тела ответа
+        view_counter.add(movie_id)
+        return not_modified(etag)
+
+    movie = await db.fetchrow("movie_by_id", movie_id)
     
     if not movie:
         raise HTTPException(
@@ -310,31 +2663,30 @@ async def get_movie(movie_id: int):
             detail="Movie not found"
         )
     
-    # Увеличиваем счетчик просмотров
-    await Database.execute(
-        "UPDATE movies SET views_count = views_count + 1 WHERE id = $1",
-        movie_id
-    )
-    
-    return dict(movie)
+    # Просмотр учитывается в буфере и попадет в БД при следующем сбросе
+    view_counter.add(movie_id)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    result = dict(movie)
+    result["views_count"] += view_counter.pending_for(movie_id)
+    return movie_response(result, response)
 
 @app.post("/api/movies", response_model=Movie, tags=["Movies"])
 async def create_movie(
     movie: MovieCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: RequestConnection = Depends(get_db)
 ):
     """
     Создание нового фильма (требует авторизации)
     - Только для авторизованных пользователей
     - Автоматически связывается с создателем
     """
-    new_movie = await Database.fetchrow(
-            """
-            INSERT INTO movies
-            (title, genre, duration, rating, description, poster_url, is_new, created_at, user_id)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-            RETURNING *
-            """,
-            movie.title, movie.genre, movie.duration, movie.rating,
-            movie.description, movie.poster_url, movie.is_new, datetime.now(timezone.utc), current_user['id'] # <-- Обратите внимание на current_user['id']
-        )
\ No newline at end of file
+    new_movie = await db.fetchrow(
+        "movie_insert",
+        movie.title, movie.genre, movie.duration, movie.rating,
+        movie.description, movie.poster_url, movie.is_new, datetime.utcnow(), current_user['id']
+    )
+    catalog_cache.invalidate_all()
+    title_index.add(new_movie["id"], new_movie["title"], new_movie["views_count"], new_movie["rating"])
+    return movie_response(dict(new_movie))
@@ -1,10 +1,20 @@
 -- Frame Database Schema
 -- Архитектура "Калашников": простая, надежная, расширяемая
 
+-- Расширения
+CREATE EXTENSION IF NOT EXISTS pg_trgm;  -- Нечеткий поиск по названиям (опечатки)
+
 -- Удаление таблиц если существуют (для чистой установки)
 DROP TABLE IF EXISTS watch_history CASCADE;
 DROP TABLE IF EXISTS favorites CASCADE;
 DROP TABLE IF EXISTS movies CASCADE;
+DROP TABLE IF EXISTS catalog_version CASCADE;
+DROP TABLE IF EXISTS movie_tombstones CASCADE;
+DROP TABLE IF EXISTS genre_counts CASCADE;
+DROP TABLE IF EXISTS movie_views_hourly CASCADE;
+DROP TABLE IF EXISTS movie_trending CASCADE;
+DROP TABLE IF EXISTS rating_histogram CASCADE;
+DROP TABLE IF EXISTS user_stats CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
 
 -- ==================== ТАБЛИЦА ПОЛЬЗОВАТЕЛЕЙ ====================
@@ -33,16 +43,249 @@ CREATE TABLE movies (
     description TEXT,                        -- Описание
     poster_url VARCHAR(500),                 -- URL постера
     is_new BOOLEAN DEFAULT FALSE,            -- Флаг новинки
-    views_count INTEGER DEFAULT 0,           -- Счетчик просмотров
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL  -- Кто загрузил
+    views_count INTEGER NOT NULL DEFAULT 0,  -- Счетчик просмотров (NOT NULL: ключ сортировки top)
+    version INTEGER NOT NULL DEFAULT 1,      -- Версия строки (растет при каждом UPDATE)
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- NOT NULL: ключ курсорной пагинации
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- Последнее изменение содержимого
+    change_version BIGINT NOT NULL DEFAULT 0,  -- Версия каталога на момент изменения (лента изменений)
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,  -- Кто загрузил
+    -- Полнотекстовый поиск: название весомее описания. Конфигурация 'simple'
+    -- без стемминга одинаково работает для русских и английских названий
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    ) STORED
 );
 
 -- Индексы для таблицы movies
-CREATE INDEX idx_movies_genre ON movies (genre);
-CREATE INDEX idx_movies_created_at ON movies (created_at DESC);
-CREATE INDEX idx_movies_rating ON movies (rating DESC);
+-- Составные индексы под keyset-пагинацию: ORDER BY created_at DESC, id DESC
+-- с фильтром по жанру и без него. Каждая страница - короткий index scan
+CREATE INDEX idx_movies_genre_created_id ON movies (genre, created_at DESC, id DESC);
+CREATE INDEX idx_movies_created_id ON movies (created_at DESC, id DESC);
+-- sort=top: ORDER BY coalesce(rating, 0) DESC, views_count DESC, id DESC.
+-- views_count в индексе лишает сброс просмотров HOT-обновлений: это цена
+-- сортировки без полного перебора каталога
+CREATE INDEX idx_movies_top ON movies ((coalesce(rating, 0)) DESC, views_count DESC, id DESC);
+CREATE INDEX idx_movies_genre_top ON movies (genre, (coalesce(rating, 0)) DESC, views_count DESC, id DESC);
 CREATE INDEX idx_movies_user_id ON movies (user_id);
+CREATE INDEX idx_movies_change_version ON movies (change_version, id);
+CREATE INDEX idx_movies_search ON movies USING GIN (search_vector);
+CREATE INDEX idx_movies_title_trgm ON movies USING GIN (title gin_trgm_ops);
+
+-- Версия строки: ключ кэша готового JSON фильма в API
+CREATE OR REPLACE FUNCTION movies_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_movies_version
+    BEFORE UPDATE ON movies
+    FOR EACH ROW EXECUTE FUNCTION movies_bump_version();
+
+-- ==================== ВЕРСИЯ КАТАЛОГА ====================
+-- Монотонная версия каталога: растет при любом изменении содержимого movies.
+-- API строит из нее ETag (304 без запроса списка) и ленту изменений.
+-- Версия выдается одна на оператор (триггер уровня оператора), все строки
+-- оператора получают ее в movies.change_version: массовая загрузка не
+-- обновляет catalog_version на каждую строку. Лента изменений поэтому
+-- листается по (change_version, id).
+-- Блокировка строки catalog_version держится до COMMIT, поэтому версии
+-- выдаются в порядке фиксации и лента изменений ничего не пропускает
+CREATE TABLE catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),  -- Ровно одна строка
+    version BIGINT NOT NULL DEFAULT 0,
+    reset_version BIGINT NOT NULL DEFAULT 0,  -- Версия последнего TRUNCATE: до нее дельты нет
+    trending_version BIGINT NOT NULL DEFAULT 0  -- Растет при каждом пересчете movie_trending
+);
+
+INSERT INTO catalog_version DEFAULT VALUES;
+
+-- Надгробия удаленных фильмов для ленты изменений
+CREATE TABLE movie_tombstones (
+    movie_id INTEGER PRIMARY KEY,
+    change_version BIGINT NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_movie_tombstones_version ON movie_tombstones (change_version, movie_id);
+
+-- Новая версия на оператор INSERT/UPDATE, до изменения первой строки
+CREATE OR REPLACE FUNCTION movies_bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Строка получает версию своего оператора (обновление выше видно в той же транзакции)
+CREATE OR REPLACE FUNCTION movies_track_change() RETURNS trigger AS $$
+BEGIN
+    SELECT version INTO NEW.change_version FROM catalog_version;
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Надгробия всех удаленных строк оператора с одной новой версией
+CREATE OR REPLACE FUNCTION movies_track_delete() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM old_rows) THEN
+        RETURN NULL;
+    END IF;
+    UPDATE catalog_version SET version = version + 1
+    RETURNING version INTO new_version;
+    INSERT INTO movie_tombstones (movie_id, change_version)
+    SELECT id, new_version FROM old_rows
+    ON CONFLICT (movie_id) DO UPDATE
+        SET change_version = EXCLUDED.change_version, deleted_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION movies_track_truncate() RETURNS trigger AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1, reset_version = version + 1;
+    TRUNCATE movie_tombstones;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- views_count в списке колонок нет: пакетный сброс просмотров не меняет версию,
+-- иначе ETag сбрасывался бы каждую секунду, а лента изменений разрасталась.
+-- Списки колонок у триггеров оператора и строки совпадают: строка не получает
+-- версию без оператора, который ее выдал
+CREATE TRIGGER trg_movies_bump_catalog_version
+    BEFORE INSERT
+       OR UPDATE OF title, genre, duration, rating, description, poster_url, is_new, created_at, user_id
+    ON movies
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_bump_catalog_version();
+
+CREATE TRIGGER trg_movies_track_change
+    BEFORE INSERT
+       OR UPDATE OF title, genre, duration, rating, description, poster_url, is_new, created_at, user_id
+    ON movies
+    FOR EACH ROW EXECUTE FUNCTION movies_track_change();
+
+CREATE TRIGGER trg_movies_track_delete
+    AFTER DELETE ON movies
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_track_delete();
+
+CREATE TRIGGER trg_movies_track_truncate
+    AFTER TRUNCATE ON movies
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_track_truncate();
+
+-- ==================== ФАСЕТЫ КАТАЛОГА ====================
+-- Счетчики для фильтров: число фильмов по жанрам и по целой части рейтинга.
+-- Ведутся триггерами уровня оператора: COPY на тысячи строк дает по одному
+-- UPSERT на жанр, а GET /api/movies/facets не считает GROUP BY по movies
+CREATE TABLE genre_counts (
+    genre VARCHAR(50) PRIMARY KEY,
+    movie_count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE rating_histogram (
+    bucket SMALLINT PRIMARY KEY,             -- floor(rating): 0..5
+    movie_count BIGINT NOT NULL DEFAULT 0
+);
+
+-- Прибавляет sign к счетчикам для каждой пары (жанр, рейтинг).
+-- Строки счетчиков обновляются в порядке ключа, чтобы параллельные
+-- транзакции не взаимоблокировались
+CREATE OR REPLACE FUNCTION movie_facets_apply(genres TEXT[], ratings NUMERIC[], sign INTEGER)
+RETURNS void AS $$
+    INSERT INTO genre_counts AS g (genre, movie_count)
+    SELECT genre, sign * count(*) FROM unnest(genres) AS genre
+    GROUP BY genre ORDER BY genre
+    ON CONFLICT (genre) DO UPDATE SET movie_count = g.movie_count + EXCLUDED.movie_count;
+
+    INSERT INTO rating_histogram AS h (bucket, movie_count)
+    SELECT floor(rating)::SMALLINT, sign * count(*) FROM unnest(ratings) AS rating
+    WHERE rating IS NOT NULL
+    GROUP BY 1 ORDER BY 1
+    ON CONFLICT (bucket) DO UPDATE SET movie_count = h.movie_count + EXCLUDED.movie_count;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION movies_track_facets() RETURNS trigger AS $$
+DECLARE
+    old_genres TEXT[];
+    old_ratings NUMERIC[];
+    new_genres TEXT[];
+    new_ratings NUMERIC[];
+BEGIN
+    -- Каждая ветка обращается только к переходным таблицам своего события
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE genre_counts, rating_histogram;
+    ELSIF TG_OP = 'INSERT' THEN
+        SELECT array_agg(genre), array_agg(rating) INTO new_genres, new_ratings
+        FROM new_rows;
+        PERFORM movie_facets_apply(new_genres, new_ratings, 1);
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(genre), array_agg(rating) INTO old_genres, old_ratings
+        FROM old_rows;
+        PERFORM movie_facets_apply(old_genres, old_ratings, -1);
+    ELSE
+        -- Только строки со сменой жанра или рейтинга: сброс просмотров ничего не пишет
+        SELECT array_agg(o.genre), array_agg(o.rating), array_agg(n.genre), array_agg(n.rating)
+        INTO old_genres, old_ratings, new_genres, new_ratings
+        FROM old_rows o JOIN new_rows n ON n.id = o.id
+        WHERE (n.genre, n.rating) IS DISTINCT FROM (o.genre, o.rating);
+        IF old_genres IS NOT NULL THEN
+            PERFORM movie_facets_apply(old_genres, old_ratings, -1);
+            PERFORM movie_facets_apply(new_genres, new_ratings, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Переходные таблицы допускают одно событие на триггер, поэтому триггеров три
+CREATE TRIGGER trg_movies_facets_insert
+    AFTER INSERT ON movies
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_track_facets();
+
+CREATE TRIGGER trg_movies_facets_update
+    AFTER UPDATE ON movies
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_track_facets();
+
+CREATE TRIGGER trg_movies_facets_delete
+    AFTER DELETE ON movies
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_track_facets();
+
+CREATE TRIGGER trg_movies_facets_truncate
+    AFTER TRUNCATE ON movies
+    FOR EACH STATEMENT EXECUTE FUNCTION movies_track_facets();
+
+-- ==================== В ТРЕНДЕ ====================
+-- Просмотры по часам: API дописывает их при пакетном сбросе счетчика.
+-- Строки старше окна трендов удаляются при пересчете
+CREATE TABLE movie_views_hourly (
+    movie_id INTEGER NOT NULL REFERENCES movies(id) ON DELETE CASCADE,
+    hour TIMESTAMP NOT NULL,                 -- Начало часа
+    views INTEGER NOT NULL,
+    PRIMARY KEY (movie_id, hour)
+);
+
+CREATE INDEX idx_movie_views_hourly_hour ON movie_views_hourly (hour);
+
+-- Очки "в тренде" (просмотры с экспоненциальным затуханием), пересчитываются
+-- фоновой задачей API. Жанр продублирован, чтобы страница жанра была
+-- index scan по (genre, score, movie_id) без соединения с movies
+CREATE TABLE movie_trending (
+    movie_id INTEGER PRIMARY KEY REFERENCES movies(id) ON DELETE CASCADE,
+    genre VARCHAR(50) NOT NULL,
+    score DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX idx_movie_trending_score ON movie_trending (score DESC, movie_id DESC);
+CREATE INDEX idx_movie_trending_genre_score ON movie_trending (genre, score DESC, movie_id DESC);
 
 -- ==================== ТАБЛИЦА ИЗБРАННОГО ====================
 -- Связь пользователей с их любимыми фильмами
@@ -57,7 +300,9 @@ CREATE TABLE favorites (
 );
 
 -- Индексы для таблицы favorites
-CREATE INDEX idx_favorites_user_id ON favorites (user_id);
+-- (user_id, movie_id) покрыт UNIQUE: проверка is_favorite для страницы фильмов.
+-- (user_id, id): список избранного, сначала недавно добавленные
+CREATE INDEX idx_favorites_user_id ON favorites (user_id, id DESC);
 CREATE INDEX idx_favorites_movie_id ON favorites (movie_id);
 
 -- ==================== ТАБЛИЦА ИСТОРИИ ПРОСМОТРОВ ====================
@@ -66,7 +311,7 @@ CREATE TABLE watch_history (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     movie_id INTEGER NOT NULL REFERENCES movies(id) ON DELETE CASCADE,
-    watched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- Время просмотра
+    watched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- Время просмотра
     progress INTEGER DEFAULT 0,                      -- Прогресс просмотра в процентах
     
     -- Один фильм может быть в истории только один раз
@@ -74,10 +319,22 @@ CREATE TABLE watch_history (
 );
 
 -- Индексы для таблицы watch_history
-CREATE INDEX idx_history_user_id ON watch_history (user_id);
+-- "Продолжить просмотр": покрывающий индекс, прогресс проверяется без чтения таблицы
+CREATE INDEX idx_history_user_watched ON watch_history (user_id, watched_at DESC) INCLUDE (movie_id, progress);
 CREATE INDEX idx_history_movie_id ON watch_history (movie_id);
 CREATE INDEX idx_history_watched_at ON watch_history (watched_at DESC);
 
+-- ==================== СТАТИСТИКА ПОЛЬЗОВАТЕЛЕЙ ====================
+-- Готовые счетчики для GET /api/users/me/stats. API меняет их в том же
+-- операторе, что и избранное, историю и загрузку фильмов; фоновая сверка
+-- пересчитывает разошедшиеся строки (ручные правки, удаление фильмов)
+CREATE TABLE user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    watched_count INTEGER NOT NULL DEFAULT 0,    -- Фильмов в истории просмотров
+    favorites_count INTEGER NOT NULL DEFAULT 0,  -- Фильмов в избранном
+    uploaded_count INTEGER NOT NULL DEFAULT 0    -- Загруженных фильмов
+);
+
 -- ==================== ТЕСТОВЫЕ ДАННЫЕ ====================
 -- Добавляем начальные данные для тестирования
 
@@ -105,18 +362,30 @@ INSERT INTO favorites (user_id, movie_id) VALUES
 INSERT INTO watch_history (user_id, movie_id, progress) VALUES
 (1, 1, 100), (1, 2, 75), (1, 3, 100), (1, 4, 30);
 
+-- Счетчики для тестовых данных (они вставлены напрямую, минуя API)
+INSERT INTO user_stats (user_id, watched_count, favorites_count, uploaded_count)
+SELECT u.id,
+       (SELECT count(*) FROM watch_history h WHERE h.user_id = u.id),
+       (SELECT count(*) FROM favorites f WHERE f.user_id = u.id),
+       (SELECT count(*) FROM movies m WHERE m.user_id = u.id)
+FROM users u;
+
 -- ==================== ПОЛЕЗНЫЕ ЗАПРОСЫ ====================
 -- Примеры запросов для работы с данными
 
--- Получить популярные фильмы (по рейтингу и просмотрам)
--- SELECT * FROM movies ORDER BY rating DESC, views_count DESC LIMIT 10;
+-- Получить популярные фильмы (по рейтингу и просмотрам, индекс idx_movies_top)
+-- SELECT * FROM movies ORDER BY coalesce(rating, 0) DESC, views_count DESC, id DESC LIMIT 10;
 
 -- Получить фильмы пользователя из избранного
 -- SELECT m.* FROM movies m 
 -- JOIN favorites f ON m.id = f.movie_id 
 -- WHERE f.user_id = 1;
 
--- Статистика пользователя
+-- Статистика пользователя (готовые счетчики)
+-- SELECT * FROM user_stats WHERE user_id = 1;
+
+-- Та же статистика подсчетом: соединения размножают строки, и запрос
+-- замедляется с ростом истории. Сверка в API считает подзапросами
 -- SELECT 
 --     COUNT(DISTINCT wh.movie_id) as watched_count,
 --     COUNT(DISTINCT f.movie_id) as favorites_count,
@@ -0,0 +1,61 @@
+"""
+Тесты разбора тела массовой загрузки (iter_bulk_records) и проверки записей
+
+Запуск: python -m pytest -q
+"""
+
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from main import MovieBase, iter_bulk_records
+
+class FakeRequest:
+    """Тело запроса, приходящее заданными кусками"""
+
+    def __init__(self, *chunks: bytes):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+def records(bulk_format: str, *chunks: bytes) -> list:
+    async def collect():
+        return [item async for item in iter_bulk_records(FakeRequest(*chunks), bulk_format)]
+    return asyncio.run(collect())
+
+def valid_movie(**fields) -> dict:
+    movie = {"title": "A", "genre": "g", "duration": 90, "rating": 4, "description": "d", "poster_url": "p"}
+    movie.update(fields)
+    return movie
+
+def test_ndjson_line_split_across_chunks():
+    items = records("ndjson", b'{"title": "Ne', b'ural"}\n\n{"title"', b': "City"}')
+    assert items == [(1, {"title": "Neural"}), (2, {"title": "City"})]
+
+def test_ndjson_errors_are_per_row():
+    items = records("ndjson", b'{"title": "A"}\nnot json\n[1]\n')
+    assert items[0] == (1, {"title": "A"})
+    assert items[1][0] == 2 and items[1][1].startswith("Invalid JSON")
+    assert items[2] == (3, "Invalid JSON: expected an object")
+
+def test_ndjson_bom():
+    assert records("ndjson", b'\xef\xbb\xbf{"title": "A"}\n') == [(1, {"title": "A"})]
+
+def test_csv_quoted_value_spans_lines_and_chunks():
+    items = records("csv", b'title,description\nA,"line one\n', b'line two"\nB,\n')
+    assert items == [(1, {"title": "A", "description": "line one\nline two"}), (2, {"title": "B"})]
+
+def test_csv_bom_header():
+    assert records("csv", "\ufefftitle,genre\r\nA,g\r\n".encode("utf-8")) == [(1, {"title": "A", "genre": "g"})]
+
+def test_csv_unterminated_quote():
+    assert records("csv", b'title\n"A\n') == [(1, "Invalid CSV: unterminated quoted value")]
+
+def test_movie_rejects_values_the_database_would_refuse():
+    MovieBase.model_validate(valid_movie())
+    for fields in ({"poster_url": "p" * 501}, {"title": "A\x00"}, {"duration": 2**31}):
+        with pytest.raises(ValidationError):
+            MovieBase.model_validate(valid_movie(**fields))
@@ -0,0 +1,61 @@
+"""
+Тесты слияния ленты изменений каталога (merge_changes)
+
+Запуск: python -m pytest -q
+"""
+
+from main import merge_changes
+
+def movie(movie_id: int, version: int) -> dict:
+    return {"id": movie_id, "change_version": version}
+
+def tombstone(movie_id: int, version: int) -> dict:
+    return {"movie_id": movie_id, "change_version": version}
+
+def after(updated, deleted, last):
+    """Остаток лент после (version, id) последнего изменения, как в SQL"""
+    cursor = last[:2]
+    return (
+        [row for row in updated if (row["change_version"], row["id"]) > cursor],
+        [row for row in deleted if (row["change_version"], row["movie_id"]) > cursor],
+    )
+
+def test_everything_fits():
+    updated = [movie(1, 1), movie(2, 3)]
+    deleted = [tombstone(10, 2)]
+    changes, has_more = merge_changes(updated, deleted, 8)
+    assert [version for version, _, _ in changes] == [1, 2, 3]
+    assert has_more is False
+
+def test_truncated_merge_reports_more():
+    # Обе ленты короче limit, но вместе длиннее: 6 + 6 > 8
+    updated = [movie(i, 2 * i - 1) for i in range(1, 7)]
+    deleted = [tombstone(100 + i, 2 * i) for i in range(1, 7)]
+    changes, has_more = merge_changes(updated, deleted, 8)
+    assert has_more is True
+    assert [version for version, _, _ in changes] == list(range(1, 9))
+
+    # Следующая страница с версии последнего изменения отдает остаток без пропусков
+    rest, has_more = merge_changes(*after(updated, deleted, changes[-1]), 8)
+    assert has_more is False
+    assert [version for version, _, _ in rest] == [9, 10, 11, 12]
+    delivered = changes + rest
+    assert sorted(row["id"] for _, _, row in delivered if row is not None) == [1, 2, 3, 4, 5, 6]
+    assert sorted(movie_id for _, movie_id, row in delivered if row is None) == [101, 102, 103, 104, 105, 106]
+
+def test_full_feed_reports_more():
+    updated = [movie(i, i) for i in range(1, 5)]
+    changes, has_more = merge_changes(updated, [], 4)
+    assert len(changes) == 4
+    assert has_more is True
+
+def test_one_version_pages_by_id():
+    # Массовая загрузка: у всех строк оператора одна версия
+    updated = [movie(i, 7) for i in range(1, 11)]
+    changes, has_more = merge_changes(updated[:4], [], 4)
+    assert has_more is True
+    assert changes[-1][:2] == (7, 4)
+    page, _ = after(updated, [], changes[-1])
+    rest, has_more = merge_changes(page, [], 10)
+    assert has_more is False
+    assert [movie_id for _, movie_id, _ in rest] == [5, 6, 7, 8, 9, 10]
@@ -0,0 +1,63 @@
+"""
+Тесты индекса подсказок поиска (fold_text, TitleIndex.apply/suggest)
+
+Запуск: python -m pytest -q
+"""
+
+from main import TitleIndex, fold_text
+
+def movie(movie_id: int, title: str, views: int = 0, rating: float = 0) -> dict:
+    return {"id": movie_id, "title": title, "views_count": views, "rating": rating}
+
+def titles(index: TitleIndex, q: str, k: int = 3) -> list:
+    return [item["title"] for item in index.suggest(q, k)]
+
+def test_fold_text():
+    assert fold_text("  Амели   С Монмартра ") == "амели с монмартра"
+    assert fold_text("Café ÉCLAIR") == "cafe eclair"
+    assert fold_text("Straße") == "strasse"
+
+def test_apply_updates_and_deletes():
+    index = TitleIndex(max_scan=100, rebuild_changes=1000, top_size=10)
+    index.apply([movie(1, "Neural City", 5), movie(2, "City Lights", 1)], [])
+    assert titles(index, "city") == ["Neural City", "City Lights"]
+
+    index.apply([movie(1, "Dark Water", 5)], [2])
+    assert titles(index, "city") == []
+    assert titles(index, "wat") == ["Dark Water"]
+    assert 2 not in index and 1 in index
+
+def test_suggest_ranks_whole_prefix_range():
+    # Популярный фильм далеко за пределом max_scan по алфавиту
+    index = TitleIndex(max_scan=100, rebuild_changes=1000, top_size=10)
+    index.apply([movie(i, f"Aa{i:04d}") for i in range(1500)] + [movie(9999, "Avatar", 10**6)], [])
+    assert titles(index, "a") == ["Avatar", "Aa0000", "Aa0001"]
+    assert titles(index, "av") == ["Avatar"]
+
+def test_views_promote_into_cached_top():
+    index = TitleIndex(max_scan=10, rebuild_changes=1000, top_size=3)
+    index.apply([movie(i, f"Aa{i:04d}", views=i) for i in range(50)], [])
+    assert titles(index, "a") == ["Aa0049", "Aa0048", "Aa0047"]
+
+    index.add_views({5: 100})
+    assert titles(index, "a") == ["Aa0005", "Aa0049", "Aa0048"]
+
+    # Уменьшение (свежие данные другого воркера) сбрасывает список
+    index.set_views(5, 0)
+    assert titles(index, "a") == ["Aa0049", "Aa0048", "Aa0047"]
+
+def test_add_and_remove_reset_cached_top():
+    index = TitleIndex(max_scan=10, rebuild_changes=1000, top_size=3)
+    index.apply([movie(i, f"Aa{i:04d}", views=i) for i in range(50)], [])
+    assert titles(index, "a", 1) == ["Aa0049"]
+    index.add(100, "Amelie", 1000, 5)
+    assert titles(index, "a", 1) == ["Amelie"]
+    index.remove(100)
+    assert titles(index, "a", 1) == ["Aa0049"]
+
+def test_build_sorts_in_chunks(monkeypatch):
+    monkeypatch.setattr(TitleIndex, "SORT_CHUNK", 7)
+    rows = [movie(i, f"Title {(i * 37) % 101} Part") for i in range(60)]
+    movies, entries = TitleIndex._build(rows)
+    assert len(movies) == 60
+    assert entries == sorted(entries) and len(entries) == 60 * 3